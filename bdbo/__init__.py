@@ -1,15 +1,28 @@
 import sys
+import weakref
 import traceback
 
 
-__all__ = ['close', 'register_close_handler']
+__all__ = ['close', 'register_close_handler', 'register_handle', 'unregister_handle', 'open_handles']
 _closehandlers = []
 
+# Kinds of handles in the order of closing: handles of a kind
+# depend on the handles of the following kinds.
+KINDS = ('cursor', 'allocator', 'sequence', 'secondary', 'primary', 'env')
+
+# Open handles are held weakly, so dropped handles do not leak
+_handles = {kind: weakref.WeakSet() for kind in KINDS}
+
 
 def close():
-    '''Run any registered exit functions, including closing
-    any DbEnv / Db objects
+    '''Run any registered exit functions, then close all open
+    handles: cursors, id allocators, sequences, secondary and primary
+    databases and environments, in this order.
+    Return list of (kind, type name, name, result) of the handles
+    whose close returned a result, like the report of DbIdAllocator
     '''
+    results = []
+
     while _closehandlers:
         try:
             handler, args, kwargs = _closehandlers.pop()
@@ -18,6 +31,22 @@ def close():
             print('!!! Error in dbo.close:', file=sys.stderr)
             traceback.print_exc()
 
+    for kind in KINDS:
+        for handle in list(_handles[kind]):
+            try:
+                name = _handle_name(handle)
+                result = handle.close()
+
+                if result is not None:
+                    results.append((kind, type(handle).__name__, name, result))
+            except:
+                print('!!! Error in dbo.close of %s %r:' % (kind, handle), file=sys.stderr)
+                traceback.print_exc()
+
+        _handles[kind].clear()
+
+    return results
+
 
 def register_close_handler(f, *args, **kwargs):
     '''Register a function to be executed by dbo.close()
@@ -26,4 +55,43 @@ def register_close_handler(f, *args, **kwargs):
     return f
 
 
+def register_handle(handle, kind):
+    '''Register an open handle to be closed by dbo.close()
+    with its close method, see KINDS
+    '''
+    _handles[kind].add(handle)
+    return handle
+
+
+def unregister_handle(handle, kind=None):
+    '''Forget the handle, as it is closed or changes the kind
+    '''
+    for k in (kind,) if kind else KINDS:
+        _handles[k].discard(handle)
+
+
+def open_handles():
+    '''Return list of (kind, type name, name) of the open handles,
+    in the order of closing
+    '''
+    report = []
+
+    for kind in KINDS:
+        for handle in list(_handles[kind]):
+            report.append((kind, type(handle).__name__, _handle_name(handle)))
+
+    return report
+
+
+def _handle_name(handle):
+    try:
+        if hasattr(handle, 'get_dbname'):
+            return '/'.join(x for x in handle.get_dbname() if x)
+
+        if hasattr(handle, 'db_home'):
+            home = handle.db_home
+            return home() if callable(home) else home
+    except Exception:
+        pass
 
+    return repr(handle)
@@ -0,0 +1,203 @@
+import io
+import struct
+
+from bsddb3.db import *
+
+__all__ = [
+    'DbBlob'
+]
+
+# Header record of chunked blobs: magic, size, chunk size
+HEADER = struct.Struct('<4s Q I')
+MAGIC = b'BLB1'
+
+# Chunk records are keyed by the tag, the key of the blob and the chunk index.
+# Keys of lexpacker are printable, so they never begin with the tag.
+CHUNK_TAG = b'\x00'
+CHUNK_INDEX = struct.Struct('>Q').pack
+
+
+class DbBlob(io.RawIOBase):
+    '''File-like access to a large value through partial gets and puts, see Db.blob.
+    Only the requested ranges are read or written, the value is never loaded whole.
+
+    By default the blob is the single record of the key. With chunksize, the blob is
+    split into records of chunksize bytes following the header record of the key,
+    which keeps pages of the database filled by records of the same size. Chunks are
+    kept apart from the keys of the database, see CHUNK_TAG, so the database must be
+    a BTREE or HASH with keys that do not begin with the tag.
+
+    Values are raw bytes, bypassing the serializer of the database, so blob keys must
+    not be read or written with Db.get and Db.put.
+    '''
+    def __init__(self, db, key, txn=None, chunksize=None):
+        if db.get_type() in (DB_RECNO, DB_QUEUE):
+            raise ValueError('Blobs require a BTREE or HASH database')
+
+        self.db = db
+        self.txn = txn
+        self._cobj = db._cobj
+        self._rkey = db.keydump(key)
+        self._pos = 0
+
+        try:
+            size = self._cobj.get_size(self._rkey, txn)
+        except DBNotFoundError:
+            size = 0
+
+        header = self._cobj.get(self._rkey, txn=txn) if size == HEADER.size else None
+
+        if header and header[:4] == MAGIC:
+            magic, self._size, self.chunksize = HEADER.unpack(header)
+        elif chunksize:
+            self.chunksize = chunksize
+            self._size = 0
+            self._putheader()
+        else:
+            self.chunksize = None
+            self._size = size
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def size(self):
+        return self._size
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError('Invalid whence %r' % whence)
+
+        if pos < 0:
+            raise ValueError('Negative seek position %i' % pos)
+
+        self._pos = pos
+        return pos
+
+    def _chunkkey(self, index):
+        return CHUNK_TAG + self._rkey + CHUNK_INDEX(index)
+
+    def _putheader(self):
+        self._cobj.put(self._rkey, HEADER.pack(MAGIC, self._size, self.chunksize), self.txn)
+        self._created()
+
+    def _created(self):
+        # The key of the blob passes the Bloom filter of the database, see Db.set_bloom
+        if self.db._bloom is not None:
+            self.db._bloom_add(self._rkey)
+
+    def _spans(self, pos, length):
+        '''Yields (record key, offset in record, length, offset in buffer) of the range.
+        '''
+        done = 0
+
+        if self.chunksize is None:
+            yield self._rkey, pos, length, 0
+            return
+
+        while done < length:
+            index, offset = divmod(pos + done, self.chunksize)
+            n = min(self.chunksize - offset, length - done)
+            yield self._chunkkey(index), offset, n, done
+            done += n
+
+    def readinto(self, buffer):
+        self._checkClosed()
+        view = memoryview(buffer).cast('B')
+        length = min(len(view), self._size - self._pos)
+
+        if length <= 0:
+            return 0
+
+        for rkey, offset, n, done in self._spans(self._pos, length):
+            data = self._cobj.get(rkey, txn=self.txn, dlen=n, doff=offset) or b''
+            view[done:done + len(data)] = data
+
+            # Sparse ranges read as zeros
+            if len(data) < n:
+                view[done + len(data):done + n] = bytes(n - len(data))
+
+        self._pos += length
+        return length
+
+    def write(self, data):
+        self._checkClosed()
+        view = memoryview(data).cast('B')
+        length = len(view)
+
+        for rkey, offset, n, done in self._spans(self._pos, length):
+            self._cobj.put(rkey, view[done:done + n].tobytes(), self.txn, dlen=n, doff=offset)
+
+        self._pos += length
+
+        if self._pos > self._size:
+            if self.chunksize is not None:
+                self._size = self._pos
+                self._putheader()
+            else:
+                if not self._size:
+                    self._created()
+
+                self._size = self._pos
+
+        return length
+
+    def truncate(self, size=None):
+        self._checkClosed()
+        size = self._pos if size is None else size
+
+        if size >= self._size:
+            return self._size
+
+        if self.chunksize is None:
+            # Partial put of empty data removes the range
+            self._cobj.put(self._rkey, b'', self.txn, dlen=self._size - size, doff=size)
+        else:
+            index, offset = divmod(size, self.chunksize)
+            last = (self._size - 1) // self.chunksize
+
+            if offset:
+                rkey = self._chunkkey(index)
+
+                if self._cobj.exists(rkey, self.txn):
+                    self._cobj.put(rkey, b'', self.txn, dlen=self.chunksize, doff=offset)
+
+                index += 1
+
+            for i in range(index, last + 1):
+                try:
+                    self._cobj.delete(self._chunkkey(i), self.txn)
+                except DBNotFoundError:
+                    pass
+
+            self._size = size
+            self._putheader()
+
+        self._size = size
+        return size
+
+    def remove(self):
+        '''Deletes the blob records and closes the blob.
+        '''
+        self.truncate(0)
+
+        try:
+            self._cobj.delete(self._rkey, self.txn)
+        except DBNotFoundError:
+            pass
+
+        self.close()
@@ -0,0 +1,248 @@
+import re
+import zlib
+import time
+import base64
+import random
+import struct
+import threading
+
+from collections import Counter
+from bsddb3.db import *
+
+__all__ = [
+    'DbCompressor',
+    'train_dictionary'
+]
+
+# Header of compressed values: zero byte, which serialized values of the
+# text serializers never start with, and the dictionary version.
+MARKER = b'\x00'
+HEADER = struct.Struct('<c H')
+
+# Fragments of values which make up the dictionary: JSON strings and keys, words and numbers
+FRAGMENTS = re.compile(rb'"[^"\\]{1,48}"\s*:?|[-\w.]{3,32}')
+
+
+def train_dictionary(samples, size=4096):
+    '''Returns zlib preset dictionary of at most size bytes built from the sample values.
+    Fragments found in more than one sample are ranked by document frequency times length;
+    the most valuable ones are placed at the end, as the nearest distances are the cheapest.
+    '''
+    samples = list(samples)
+    frequency = Counter()
+
+    for sample in samples:
+        frequency.update(set(FRAGMENTS.findall(sample)))
+
+    ranked = sorted((f for f, n in frequency.items() if n > 1),
+                    key=lambda f: frequency[f] * len(f),
+                    reverse=True)
+    chosen = []
+    total = 0
+
+    for fragment in ranked:
+        if total + len(fragment) > size:
+            continue
+
+        chosen.append(fragment)
+        total += len(fragment)
+
+    # The rest is filled with whole samples, which carry the structure of values
+    filler = []
+
+    for sample in samples:
+        if total + len(sample) > size:
+            break
+
+        filler.append(sample)
+        total += len(sample)
+
+    return b''.join(filler + chosen[::-1])
+
+
+class DbCompressor:
+    '''Compresses values of the database with zlib and the preset dictionary trained from its records.
+    Wraps datadump and dataload of the database, see DbCompressor.install. Serialized values shorter
+    than threshold bytes, or which do not get shorter, are stored as they are.
+
+    Dictionaries are versioned in the registry database of the environment (DbEnv(registry=True)),
+    a compressed value refers to the version it was compressed with, so the values compressed
+    with the older dictionaries stay readable after DbCompressor.train.
+    '''
+    def __init__(self, db, threshold=64, level=6, dictsize=4096):
+        if getattr(db, 'registry_db', None) is None:
+            raise ValueError('Compression dictionaries require DbEnv(registry=True)')
+
+        filename, dbname = db.get_dbname()
+        self.db = db
+        self.threshold = threshold
+        self.level = level
+        self.dictsize = dictsize
+
+        self._regkey = ['compression', filename or '', dbname or '']
+        self._dicts = {}
+        self._lock = threading.Lock()
+        self._version = 0
+        self._zdict = None
+        self._stats = {
+            'compressed': 0,
+            'raw': 0,
+            'bytes_in': 0,
+            'bytes_out': 0
+        }
+
+        current = db.registry_db.get(self._regkey + ['current'])
+
+        if current:
+            self._use(current['version'])
+
+        self._dump, self._load = db.datadump, db.dataload
+
+    def install(self):
+        '''Sets datadump and dataload of the database to the compressing ones.
+        '''
+        self.db.datadump = self.datadump
+        self.db.dataload = self.dataload
+        return self
+
+    def uninstall(self):
+        '''Restores the serializer of the database, compressed values are no longer readable by it.
+        '''
+        self.db.datadump = self._dump
+        self.db.dataload = self._load
+
+    def _dictionary(self, version):
+        try:
+            return self._dicts[version]
+        except KeyError:
+            pass
+
+        record = self.db.registry_db.get(self._regkey + [version])
+
+        if record is None:
+            raise KeyError('Unknown compression dictionary version %i' % version)
+
+        with self._lock:
+            return self._dicts.setdefault(version, base64.b64decode(record['dictionary']))
+
+    def _use(self, version):
+        self._zdict = self._dictionary(version)
+        self._header = HEADER.pack(MARKER, version)
+        self._version = version
+
+    def datadump(self, data):
+        raw = self._dump(data)
+        stats = self._stats
+
+        if self._zdict is None or len(raw) < self.threshold:
+            stats['raw'] += 1
+            return raw
+
+        if isinstance(raw, str):
+            raw = raw.encode()
+
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, self._zdict)
+        rdata = self._header + compressor.compress(raw) + compressor.flush()
+
+        if len(rdata) >= len(raw):
+            stats['raw'] += 1
+            return raw
+
+        stats['compressed'] += 1
+        stats['bytes_in'] += len(raw)
+        stats['bytes_out'] += len(rdata)
+        return rdata
+
+    def dataload(self, rdata):
+        if rdata[:1] != MARKER:
+            return self._load(rdata)
+
+        return self._load(self._decompress(rdata))
+
+    def _decompress(self, rdata):
+        marker, version = HEADER.unpack_from(rdata)
+        decompressor = zlib.decompressobj(-15, self._dictionary(version))
+        data = decompressor.decompress(rdata[HEADER.size:])
+
+        if not decompressor.eof or decompressor.unused_data:
+            raise zlib.error('Not a complete compressed value')
+
+        return data
+
+    def sample(self, count=1000, scan=None, txn=None):
+        '''Returns list of up to count serialized values picked uniformly from the first scan records
+        (by default 100 times count) of the database. Records starting with the marker which are
+        not compressed values, such as raw blob data, are skipped.
+        '''
+        scan = scan or count * 100
+        samples = []
+        rng = random.Random()
+        cursor = self.db._cobj.cursor(txn)
+
+        try:
+            record = cursor.first()
+            seen = 0
+
+            while record and seen < scan:
+                rdata = record[1]
+                record = cursor.next()
+
+                if rdata[:1] == MARKER:
+                    try:
+                        rdata = self._decompress(rdata)
+                    except (struct.error, KeyError, zlib.error):
+                        # Unknown dictionary version or not a deflate stream
+                        continue
+
+                # Reservoir sampling
+                if len(samples) < count:
+                    samples.append(rdata)
+                else:
+                    i = rng.randrange(seen + 1)
+
+                    if i < count:
+                        samples[i] = rdata
+
+                seen += 1
+        finally:
+            cursor.close()
+
+        return samples
+
+    def train(self, count=1000, scan=None, txn=None):
+        '''Trains the dictionary from sampled records and makes it current for new values.
+        Returns the new version, or None if the database has no values to train on.
+        '''
+        zdict = train_dictionary(self.sample(count, scan, txn), self.dictsize)
+
+        if not zdict:
+            return None
+
+        registry = self.db.registry_db
+        current = registry.get(self._regkey + ['current'], txn=txn) or {'version': 0}
+        version = current['version'] + 1
+
+        if version > 0xFFFF:
+            raise ValueError('Compression dictionary versions exhausted')
+
+        registry.put(self._regkey + [version], {
+            'dictionary': base64.b64encode(zdict).decode('ascii'),
+            'created': time.time(),
+            'samples': count
+        }, txn=txn)
+        registry.put(self._regkey + ['current'], {'version': version}, txn=txn)
+
+        with self._lock:
+            self._dicts[version] = zdict
+
+        self._use(version)
+        return version
+
+    def stats(self):
+        '''Returns counters of the written values and the compression ratio of the compressed ones.
+        '''
+        stats = dict(self._stats)
+        stats['version'] = self._version
+        stats['dictsize'] = len(self._zdict or b'')
+        stats['ratio'] = stats['bytes_out'] / (stats['bytes_in'] or 1)
+        return stats
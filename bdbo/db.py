@@ -1,7 +1,17 @@
+import os
 import types
 import json
+import random
+import struct
+import weakref
+import warnings
+import threading
+import inspect
+import functools
 import contextlib
 
+from time import perf_counter, sleep
+
 from bsddb3.db import *
 
 # Rename native interfaces
@@ -9,13 +19,18 @@ from bsddb3.db import DB as cDB
 from bsddb3.db import DBEnv as cDBEnv
 from bsddb3.db import DBSequence as cDBSequence
 
-from .util import lexpacker
-from . import register_close_handler
+from .util import lexpacker, forkgeneration, BloomFilter
+from .compression import DbCompressor
+from .blob import DbBlob
+from . import register_handle, unregister_handle
 
 __all__ = [
     'DbEnv',
     'Db',
-    'DbSequence'
+    'DbSequence',
+    'DbIdAllocator',
+    'WriteBatch',
+    'GroupCommit'
     
 ] + [k for k in globals().keys() if k.startswith('DB_')]
 
@@ -24,9 +39,21 @@ class DbEnv(object):
     def __init__(self, *args, registry=False, **kwargs):
         self._registry = registry
         self._cobj = cDBEnv(*args, **kwargs)
-        register_close_handler(self._cobj.close)
+        self.group_commit = None
+        self._txnretry = (10, 0.001, 0.25)
+        self._txnstats = {}
+        self._txnstatslock = threading.Lock()
+        _bind_delegates(self, DbEnv)
+        register_handle(self, 'env')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
 
     def close(self, *args, **kwargs):
+        unregister_handle(self, 'env')
         return self._cobj.close(*args, **kwargs)
 
     def db_home(self, *args, **kwargs):
@@ -224,6 +251,10 @@ class DbEnv(object):
 
         self._cobj.open(*args, **kwargs)
 
+        # Deadlocks are resolved when they occur, unless configured otherwise
+        if self.get_open_flags() & DB_INIT_LOCK and not self.get_lk_detect():
+            self.set_lk_detect(DB_LOCK_DEFAULT)
+
         if self._registry:
             self.registry_db = Db(self)
             self.registry_db.open('_registry.db', None, DB_BTREE, DB_CREATE, 0)
@@ -414,8 +445,16 @@ class DbEnv(object):
         return self._cobj.txn_begin(*args, **kwargs)
 
     @contextlib.contextmanager
-    def txn_begin_ctx(self, *args, **kwargs):
-        txn = self._cobj.txn_begin(*args, **kwargs)
+    def txn_begin_ctx(self, parent=None, flags=0, snapshot=False):
+        '''Yields transaction, which is committed on exit or aborted on exception.
+        With snapshot=True the transaction reads the committed versions of pages as of its
+        first read (DB_TXN_SNAPSHOT), without read locks, from the databases opened with
+        multiversion=True (see Db.open). Such transaction is meant for reads only.
+        '''
+        if snapshot:
+            flags |= DB_TXN_SNAPSHOT
+
+        txn = self._cobj.txn_begin(parent, flags)
 
         try:
             yield txn
@@ -425,6 +464,88 @@ class DbEnv(object):
         else:
             txn.commit()
 
+    def set_txn_retry(self, attempts=10, backoff=0.001, maxbackoff=0.25):
+        '''Sets the defaults of DbEnv.txn_run: number of attempts and the backoff range in seconds.
+        '''
+        self._txnretry = (attempts, backoff, maxbackoff)
+
+    def txn_run(self, func, *args, parent=None, flags=0, attempts=None, name=None, **kwargs):
+        '''Runs func(txn, *args, **kwargs) in a transaction, commits it and returns the result.
+        On deadlock or lock not granted the transaction is aborted and func is run again
+        after the jittered exponential backoff, up to attempts times; then the error is raised.
+        Retries are counted per name (default is the qualified name of func), see DbEnv.txn_runstats.
+        '''
+        default, backoff, maxbackoff = self._txnretry
+        attempts = attempts or default
+        wasted = 0.0
+
+        for attempt in range(attempts):
+            started = perf_counter()
+            txn = self._cobj.txn_begin(parent, flags)
+
+            try:
+                result = func(txn, *args, **kwargs)
+            except (DBLockDeadlockError, DBLockNotGrantedError):
+                txn.abort()
+                wasted += perf_counter() - started
+
+                if attempt + 1 == attempts:
+                    self._txncount(name or func.__qualname__, attempt, wasted, True)
+                    raise
+
+                delay = random.uniform(0, min(maxbackoff, backoff * 2 ** attempt))
+                sleep(delay)
+                wasted += delay
+            except:
+                txn.abort()
+                raise
+            else:
+                txn.commit()
+                self._txncount(name or func.__qualname__, attempt, wasted, False)
+                return result
+
+    def _txncount(self, name, retries, wasted, failed):
+        with self._txnstatslock:
+            try:
+                stats = self._txnstats[name]
+            except KeyError:
+                stats = self._txnstats[name] = {
+                    'runs': 0,
+                    'retries': 0,
+                    'failures': 0,
+                    'wasted_seconds': 0.0
+                }
+
+            stats['runs'] += 1
+            stats['retries'] += retries
+            stats['failures'] += failed
+            stats['wasted_seconds'] += wasted
+
+    def txn_runstats(self, reset=False):
+        '''Returns dict of name -> runs, retries, failures and wasted_seconds of DbEnv.txn_run.
+        Wasted time includes the aborted attempts and the backoff sleeps.
+        '''
+        with self._txnstatslock:
+            stats = {name: dict(v) for name, v in self._txnstats.items()}
+
+            if reset:
+                self._txnstats = {}
+
+        return stats
+
+    def set_group_commit(self, maxdelay=0.002, maxbatch=64):
+        '''Enables GroupCommit for WriteBatch commits of this environment, None as maxdelay disables it.
+        '''
+        if maxdelay is None:
+            self.group_commit = None
+        else:
+            self.group_commit = GroupCommit(self, maxdelay, maxbatch)
+
+    def write_batch(self, txn=None):
+        '''Returns WriteBatch of the environment, see WriteBatch.
+        '''
+        return WriteBatch(self, txn)
+
     def txn_checkpoint(self, *args, **kwargs):
         return self._cobj.txn_checkpoint(*args, **kwargs)
 
@@ -448,16 +569,101 @@ class Db(object):
         else:
             self._cobj = cDB(dbenv, flags)
 
-        register_close_handler(self._cobj.close)
+        register_handle(self, 'primary')
+        _bind_delegates(self, Db)
         
         self.dbenv = dbenv
-        self.capsule = lambda x: x
+        self.capsule = _identity
         self.keydump, self.keyload = lexpacker()
         self.datadump, self.dataload = self.default_serializer
 
         self.rangecursor = types.MethodType(DbRangeCursor, self)
 
-    def open(self, filename, dbname=None, dbtype=DB_UNKNOWN, flags=0, mode=0o660, txn=None):
+        self._bloom = None
+        self._bloomconfig = None
+        self._bloomlock = threading.Lock()
+        self._bloompending = None
+        self._bloomthread = None
+        self._metrics = None
+        self._idallocator = None
+        self._fastpath = False
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+
+        if name in FASTPATH_ATTRS and self.__dict__.get('_fastpath'):
+            self._bind_fastpath()
+
+    def _bind_fastpath(self):
+        '''Binds get, put and exists of the open database as closures over its codecs,
+        without the attribute lookups and the identity capsule of the generic methods.
+        Databases with metrics or Bloom filter, and the methods overridden by
+        subclasses keep the generic methods.
+        '''
+        attrs = self.__dict__
+
+        for name in ('get', 'put', 'exists'):
+            attrs.pop(name, None)
+
+        if self._metrics is not None or self._bloom is not None:
+            return
+
+        cls = type(self)
+        keydump = self.keydump
+        datadump = self.datadump
+        dataload = self.dataload
+        capsule = self.capsule
+
+        if cls.get is Db.get:
+            cget = self._cobj.get
+
+            if capsule is _identity:
+                def get(key, default=None, txn=None, flags=0, dlen=-1, doff=-1):
+                    rdata = cget(keydump(key), default, txn, flags, dlen, doff)
+                    return dataload(rdata) if rdata else None
+            else:
+                def get(key, default=None, txn=None, flags=0, dlen=-1, doff=-1):
+                    rdata = cget(keydump(key), default, txn, flags, dlen, doff)
+                    return capsule(dataload(rdata)) if rdata else None
+
+            attrs['get'] = get
+
+        if cls.put is Db.put:
+            cput = self._cobj.put
+
+            if self._idallocator is None:
+                def put(key, data, txn=None, flags=0, dlen=-1, doff=-1):
+                    return cput(keydump(key), datadump(data), txn, flags, dlen, doff)
+            else:
+                allocate = self._idallocator.allocate
+
+                def put(key, data, txn=None, flags=0, dlen=-1, doff=-1):
+                    if key is None:
+                        key = allocate()
+                        cput(keydump(key), datadump(data), txn, flags, dlen, doff)
+                        return key
+
+                    return cput(keydump(key), datadump(data), txn, flags, dlen, doff)
+
+            attrs['put'] = put
+
+        if cls.exists is Db.exists:
+            cexists = self._cobj.exists
+
+            def exists(key, txn=None, flags=0):
+                return cexists(keydump(key), txn, flags)
+
+            attrs['exists'] = exists
+
+    def open(self, filename, dbname=None, dbtype=DB_UNKNOWN, flags=0, mode=0o660, txn=None, multiversion=False):
+        '''Opens the database, see DB->open.
+        multiversion=True opens it with DB_MULTIVERSION, so snapshot transactions read it
+        without blocking writers (see DbEnv.txn_begin_ctx). The database must be opened
+        transactionally, with txn or DB_AUTO_COMMIT.
+        '''
+        if multiversion:
+            flags |= DB_MULTIVERSION
+
         self._cobj.open(filename, dbname, dbtype, flags, mode, txn)
 
         if dbtype in (DB_RECNO, DB_QUEUE):
@@ -466,6 +672,181 @@ class Db(object):
         if self.dbenv:
             self.registry_db = self.dbenv.registry_db
 
+        if self._bloomconfig is not None:
+            if self.get_type() in (DB_RECNO, DB_QUEUE):
+                self._bloomconfig = None
+            else:
+                self._bloom_open(filename, dbname, txn)
+
+        self._fastpath = True
+        self._bind_fastpath()
+
+    def set_bloom(self, capacity, fprate=0.01, rebuild=0.25, path=None):
+        '''Enables Bloom filter of keys, which answers Db.get and Db.exists for missing keys without reading the database. Must be called before Db.open.
+        capacity:
+            Expected number of keys. When more keys were added, the filter is rebuilt with the capacity doubled until it holds them.
+        fprate:
+            False positive rate at the capacity.
+        rebuild:
+            The filter is rebuilt when deleted keys exceed this fraction of all keys, None disables it.
+            Rebuilds run in a thread, outside of the transaction of the delete, see Db.rebuild_bloom.
+        path:
+            File to keep the filter between Db.close and Db.open, by default the database file name with ".bloom" suffix.
+
+        The filter is local to this handle: all writes must go through Db.put of this handle, which is not the case for secondary databases, raw cursors and other processes.
+        '''
+        self._bloomconfig = {
+            'capacity': capacity,
+            'fprate': fprate,
+            'rebuild': rebuild,
+            'path': path
+        }
+
+    def _bloom_open(self, filename, dbname, txn):
+        config = self._bloomconfig
+
+        if config['path'] is None and filename:
+            cdbenv = getattr(self.dbenv, '_cobj', self.dbenv)
+            home = getattr(cdbenv, 'db_home', None)
+            name = filename + ('.' + dbname if dbname else '') + '.bloom'
+            config['path'] = os.path.join(home or '', name)
+
+        self._bloomstats = {
+            'checks': 0,
+            'negatives': 0,
+            'falsepositives': 0,
+            'deletes': 0,
+            'rebuilds': 0
+        }
+
+        # The file is removed once loaded, so the filter of a handle
+        # that was not closed cleanly is never trusted
+        path = config['path']
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    self._bloom = BloomFilter.loads(f.read(), config['capacity'])
+            except (ValueError, struct.error):
+                self._bloom = None
+
+            # Filter saved with other capacity or fprate than set_bloom requested
+            expected = BloomFilter.parameters(config['capacity'], config['fprate'])
+
+            if self._bloom is not None and (self._bloom.nbits, self._bloom.nhashes) != expected:
+                self._bloom = None
+
+            os.remove(path)
+
+        if self._bloom is None:
+            # Initial filter of the keys seen by the opening transaction
+            self._bloom = self._bloom_build(self._bloom_scan(txn))
+
+    def _bloom_scan(self, txn=None):
+        rkeys = []
+        cursor = self._cobj.cursor(txn, DB_CURSOR_BULK)
+
+        try:
+            record = cursor.first(dlen=0, doff=0)
+
+            while record:
+                rkeys.append(record[0])
+                record = cursor.next(dlen=0, doff=0)
+        finally:
+            cursor.close()
+
+        return rkeys
+
+    def _bloom_build(self, rkeys):
+        # The capacity is doubled until it holds the keys
+        config = self._bloomconfig
+
+        while config['capacity'] < len(rkeys):
+            config['capacity'] *= 2
+
+        bloom = BloomFilter(config['capacity'], config['fprate'])
+
+        for rkey in rkeys:
+            bloom.add(rkey)
+
+        return bloom
+
+    def rebuild_bloom(self):
+        '''Rebuilds the Bloom filter of keys by a cursor scan outside of any transaction,
+        so it waits for the writers holding locks. Keys put during the scan are added
+        to the new filter before it replaces the current one.
+        Returns False if another rebuild is running.
+        '''
+        with self._bloomlock:
+            if self._bloompending is not None:
+                return False
+
+            self._bloompending = []
+
+        try:
+            rkeys = self._bloom_scan()
+        except BaseException:
+            with self._bloomlock:
+                self._bloompending = None
+
+            raise
+
+        with self._bloomlock:
+            rkeys.extend(self._bloompending)
+            self._bloom = self._bloom_build(rkeys)
+            self._bloompending = None
+            self._bloomstats['deletes'] = 0
+            self._bloomstats['rebuilds'] += 1
+
+        return True
+
+    def _bloom_rebuild_later(self):
+        '''Starts rebuild_bloom in a thread: the caller's transaction may hold locks the scan waits for.
+        '''
+        if self._bloompending is not None or (self._bloomthread and self._bloomthread.is_alive()):
+            return
+
+        def rebuild():
+            try:
+                self.rebuild_bloom()
+            except DBError as e:
+                warnings.warn('Bloom filter rebuild failed: %s' % e, RuntimeWarning)
+
+        self._bloomthread = threading.Thread(target=rebuild, daemon=True)
+        self._bloomthread.start()
+
+    def _bloom_add(self, rkey):
+        with self._bloomlock:
+            bloom = self._bloom
+            added = bloom.add(rkey)
+
+            if self._bloompending is not None:
+                self._bloompending.append(rkey)
+
+        if added and bloom.count > bloom.capacity:
+            self._bloom_rebuild_later()
+
+    def bloomstats(self):
+        '''Returns dict of the Bloom filter statistics:
+            checks - lookups checked against the filter
+            negatives - lookups answered by the filter
+            falsepositives - passed lookups of missing keys
+            deletes - deleted keys since the last rebuild
+            rebuilds
+            fprate - estimated false positive rate of the filter
+        '''
+        if self._bloom is None:
+            return None
+
+        stats = dict(self._bloomstats)
+        stats['fprate'] = self._bloom.fprate()
+        return stats
+
+    def write_batch(self, txn=None):
+        '''Returns WriteBatch of the database environment, see WriteBatch.
+        '''
+        return WriteBatch(self.dbenv, txn)
+
     def encapsulate(self, class_or_callable):
         self.capsule = class_or_callable
         return self.capsule
@@ -490,6 +871,13 @@ class Db(object):
 
                 self._cobj.associate(secdb._cobj, wrapper, flags, txn)
 
+            # Secondary records are written by the library, bypassing Db.put
+            secdb._bloom = secdb._bloomconfig = None
+
+            # Secondaries are closed before their primaries
+            unregister_handle(secdb, 'primary')
+            register_handle(secdb, 'secondary')
+
             return callback
 
         return decorator
@@ -518,28 +906,151 @@ class Db(object):
         record['version'] = version
         self.registry_db.put(key, record, txn=txn)
 
+    def blob(self, key, txn=None, chunksize=None):
+        '''Returns file-like DbBlob of the key, read and written by ranges with partial gets and puts.
+        '''
+        return DbBlob(self, key, txn, chunksize)
+
+    def set_compression(self, threshold=64, level=6, dictsize=4096):
+        '''Enables compression of values with trained zlib dictionaries and returns the DbCompressor, see bdbo.compression.
+        Must be called after Db.open; values are compressed once DbCompressor.train made a dictionary.
+        '''
+        self.compressor = DbCompressor(self, threshold, level, dictsize).install()
+        return self.compressor
+
+    def set_idallocator(self, allocator):
+        '''Sets DbIdAllocator which allocates the key of Db.put called with None key, then Db.put returns the key.
+        '''
+        self._idallocator = allocator
+
+    def set_metrics(self, metrics, name=None):
+        '''Enables operation metrics, see bdbo.metrics.DbMetrics. None disables them.
+        The name defaults to the database file name, so it should be called after Db.open.
+        '''
+        if metrics is not None and name is None:
+            filename, dbname = self.get_dbname()
+            name = '/'.join(x for x in (filename, dbname) if x) or repr(self)
+
+        self._metricsname = name
+        self._metrics = metrics
+
     def get(self, key, default=None, txn=None, flags=0, dlen=-1, doff=-1):
-        rkey = self.keydump(key)
-        rdata = self._cobj.get(rkey, default, txn, flags, dlen, doff)
-        return self.capsule(self.dataload(rdata)) if rdata else None
+        if self._metrics is not None:
+            return self._measured('get', lambda: (self.keydump(key), default, txn, flags, dlen, doff),
+                                  self._get_call, self._decode)
+
+        return self._decode(self._get_call(self.keydump(key), default, txn, flags, dlen, doff))
 
     def put(self, key, data, txn=None, flags=0, dlen=-1, doff=-1):
-        rkey = self.keydump(key)
-        rdata = self.datadump(data)
-        return self._cobj.put(rkey, rdata, txn, flags, dlen, doff)
+        if key is None and self._idallocator is not None:
+            key = self._idallocator.allocate()
+            self.put(key, data, txn, flags, dlen, doff)
+            return key
+
+        if self._metrics is not None:
+            return self._measured('put', lambda: (self.keydump(key), self.datadump(data), txn, flags, dlen, doff),
+                                  self._put_call)
+
+        return self._put_call(self.keydump(key), self.datadump(data), txn, flags, dlen, doff)
     
     def delete(self, key, txn=None, flags=0):
-        rkey = self.keydump(key)
-        
+        if self._metrics is not None:
+            return self._measured('delete', lambda: (self.keydump(key), txn, flags), self._delete_call)
+
+        return self._delete_call(self.keydump(key), txn, flags)
+
+    def exists(self, key, txn=None, flags=0):
+        if self._metrics is not None:
+            return self._measured('exists', lambda: (self.keydump(key), txn, flags), self._exists_call)
+
+        return self._exists_call(self.keydump(key), txn, flags)
+
+    def _measured(self, op, encode, call, decode=None):
+        '''Runs the phases of the operation and records their time, see bdbo.metrics.DbMetrics:
+        encode() returns the arguments of call(), decode() takes its result.
+        '''
+        t0 = perf_counter()
+        args = encode()
+        t1 = perf_counter()
+
+        try:
+            ret = call(*args)
+        except DBError:
+            self._metrics.error(self._metricsname, op)
+            raise
+
+        t2 = perf_counter()
+
+        if decode is not None:
+            ret = decode(ret)
+
+        self._metrics.observe(self._metricsname, op, t1 - t0, t2 - t1, perf_counter() - t2)
+        return ret
+
+    def _decode(self, rdata):
+        return self.capsule(self.dataload(rdata)) if rdata else None
+
+    def _get_call(self, rkey, default, txn, flags, dlen, doff):
+        if self._bloom is not None and not self._bloom_check(rkey):
+            return None
+
+        rdata = self._cobj.get(rkey, default, txn, flags, dlen, doff)
+
+        if not rdata and self._bloom is not None:
+            self._bloomstats['falsepositives'] += 1
+
+        return rdata
+
+    def _put_call(self, rkey, rdata, txn, flags, dlen, doff):
+        ret = self._cobj.put(rkey, rdata, txn, flags, dlen, doff)
+
+        if self._bloom is not None:
+            self._bloom_add(rkey)
+
+        return ret
+
+    def _delete_call(self, rkey, txn, flags):
         try:
             self._cobj.delete(rkey, txn, flags)
-            return True
         except DBNotFoundError:
             return False
 
-    def exists(self, key, txn=None, flags=0):
-        rkey = self.keydump(key)
-        return self._cobj.exists(rkey, txn, flags)
+        if self._bloom is not None:
+            self._bloom_deleted()
+
+        return True
+
+    def _exists_call(self, rkey, txn, flags):
+        if self._bloom is None:
+            return self._cobj.exists(rkey, txn, flags)
+
+        if not self._bloom_check(rkey):
+            return False
+
+        ret = self._cobj.exists(rkey, txn, flags)
+
+        if not ret:
+            self._bloomstats['falsepositives'] += 1
+
+        return ret
+
+    def _bloom_check(self, rkey):
+        stats = self._bloomstats
+        stats['checks'] += 1
+
+        if rkey in self._bloom:
+            return True
+
+        stats['negatives'] += 1
+        return False
+
+    def _bloom_deleted(self):
+        stats = self._bloomstats
+        stats['deletes'] += 1
+        rebuild = self._bloomconfig['rebuild']
+
+        if rebuild is not None and stats['deletes'] > rebuild * max(self._bloom.count, 1):
+            self._bloom_rebuild_later()
     
     def cursor(self, txn=None, flags=0):
         return self._cobj.cursor(txn, flags)
@@ -554,12 +1065,34 @@ class Db(object):
         return self._cobj.join(*args, **kwargs)
 
     def truncate(self, txn=None, flags=0):
-        return self._cobj.truncate(txn, flags)
+        ret = self._cobj.truncate(txn, flags)
+
+        if self._bloom is not None:
+            self._bloom.clear()
+
+        return ret
 
     def get_transactional(self):
         return self._cobj.get_transactional()
     
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
     def close(self, *args, **kwargs):
+        unregister_handle(self)
+
+        if self._bloomthread is not None:
+            self._bloomthread.join()
+
+        if self._bloom is not None and self._bloomconfig['path']:
+            with open(self._bloomconfig['path'], 'wb') as f:
+                f.write(self._bloom.dumps())
+
+            self._bloom = None
+
         return self._cobj.close(*args, **kwargs)
     
     def consume(self, *args, **kwargs):
@@ -661,20 +1194,22 @@ class Db(object):
 
 # Range-based cursor for DB_BTREE databases
 class DbRangeCursor:
-    __slots__ = ['db', '_cursor', '_begin', '_end']
+    __slots__ = ['db', '_cursor', '_begin', '_end', '__weakref__']
 
     def __init__(self, db, begin, end=None, txn=None, flags=0):
         self.db = db
         self._cursor = db._cobj.cursor(txn, flags | DB_CURSOR_BULK)
+        register_handle(self, 'cursor')
         self.set(begin, end)
 
     def __enter__(self):
         return self
     
     def __exit__(self, exc_type, exc_value, tb):
-        self._cursor.close()
+        self.close()
 
     def close(self):
+        unregister_handle(self, 'cursor')
         self._cursor.close()
 
     def set(self, begin, end=None):
@@ -729,6 +1264,10 @@ class DbRangeCursor:
             return self._cursor.get_recno() - begin_recno + 1
 
     def fetch(self, count):
+        if self.db._metrics is not None:
+            yield from self._fetch_measured(count)
+            return
+
         try:
             record = self._cursor.current()
         except DBInvalidArgError:
@@ -741,6 +1280,52 @@ class DbRangeCursor:
             else:
                 break
 
+    def fetchraw(self, count):
+        '''Yields up to count (rkey, rdata) records of the range as stored, without decoding.
+        '''
+        try:
+            record = self._cursor.current()
+        except DBInvalidArgError:
+            return
+
+        for i in range(count):
+            if record and record[0] >= self._begin and record[0] <= self._end:
+                yield record
+                record = self._cursor.next()
+            else:
+                break
+
+    def _fetch_measured(self, count):
+        db = self.db
+        call = decode = 0.0
+        items = 0
+        t = perf_counter()
+
+        try:
+            try:
+                record = self._cursor.current()
+            except DBInvalidArgError:
+                return
+
+            for i in range(count):
+                if record and record[0] >= self._begin and record[0] <= self._end:
+                    t1 = perf_counter()
+                    call += t1 - t
+                    value = db.capsule(db.dataload(record[1]))
+                    decode += perf_counter() - t1
+                    items += 1
+                    yield value
+
+                    # Time of the consumer is not counted
+                    t = perf_counter()
+                    record = self._cursor.next()
+                else:
+                    break
+
+            call += perf_counter() - t
+        finally:
+            db._metrics.observe(db._metricsname, 'rangefetch', 0.0, call, decode, items)
+
 
 class DbSequence:
     def __init__(self, db):
@@ -748,8 +1333,11 @@ class DbSequence:
             db = db._cobj
         
         self._cobj = cDBSequence(db)
+        _bind_delegates(self, DbSequence)
+        register_handle(self, 'sequence')
 
     def close(self, *args, **kwargs):
+        unregister_handle(self, 'sequence')
         return self._cobj.close(*args, **kwargs)
 
     def get(self, *args, **kwargs):
@@ -792,3 +1380,330 @@ class DbSequence:
         return self._cobj.get_range(*args, **kwargs)
 
 
+class DbIdAllocator:
+    '''Allocates unique integer ids from DbSequence, reserving blocks of them per thread.
+    Ids of the block are handed out without locks; the block size is doubled when the thread
+    uses up blocks faster than every interval seconds and halved when it takes more than four
+    intervals, within minblock and maxblock. After fork the child reserves its own blocks.
+
+        sequence = DbSequence(db)
+        sequence.initial_value(1)
+        sequence.open(b'ids', None, DB_CREATE | DB_THREAD)
+        db.set_idallocator(DbIdAllocator(sequence))
+        key = db.put(None, data)
+
+    Ids left in the blocks at close are wasted, see DbIdAllocator.report, which is also
+    returned by DbIdAllocator.close and bdbo.close.
+    '''
+    def __init__(self, sequence, minblock=16, maxblock=65536, interval=1.0):
+        self.sequence = sequence
+        self.minblock = minblock
+        self.maxblock = maxblock
+        self.interval = interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._reset(forkgeneration())
+        register_handle(self, 'allocator')
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=functools.partial(_allocator_afterfork, weakref.ref(self)))
+
+    def _reset(self, generation):
+        self._generation = generation
+        # Blocks of the threads: [next id, end id]
+        self._blocks = []
+        self._allocated = 0
+        self._refills = 0
+
+    def allocate(self):
+        local = self._local
+
+        try:
+            block = local.block
+
+            if block[0] < block[1] and local.generation == forkgeneration():
+                value = block[0]
+                block[0] = value + 1
+                return value
+        except AttributeError:
+            pass
+
+        return self._refill(local)
+
+    def _refill(self, local):
+        generation = forkgeneration()
+
+        if self._generation != generation:
+            # Blocks of the parent process are its own. Reset after fork, unless
+            # the child hook did it already, see _allocator_afterfork
+            with self._lock:
+                if self._generation != generation:
+                    self._reset(generation)
+
+        now = perf_counter()
+
+        if getattr(local, 'generation', None) != generation:
+            local.generation = generation
+            local.size = self.minblock
+            local.block = [0, 0]
+
+            with self._lock:
+                self._blocks.append(local.block)
+        else:
+            elapsed = now - local.refilled
+
+            if elapsed < self.interval:
+                local.size = min(local.size * 2, self.maxblock)
+            elif elapsed > self.interval * 4:
+                local.size = max(local.size // 2, self.minblock)
+
+        size = local.size
+        first = self.sequence.get(size)
+        local.refilled = now
+
+        with self._lock:
+            self._allocated += size
+            self._refills += 1
+
+        block = local.block
+        block[0] = first + 1
+        block[1] = first + size
+        return first
+
+    def report(self):
+        '''Returns dict of ids reserved from the sequence by this process, the number of
+        reservations, and ids which are reserved but not handed out (wasted, if closed now).
+        '''
+        with self._lock:
+            unused = sum(end - start for start, end in self._blocks)
+
+            return {
+                'allocated': self._allocated,
+                'refills': self._refills,
+                'issued': self._allocated - unused,
+                'wasted': unused
+            }
+
+    def close(self):
+        '''Returns DbIdAllocator.report; the sequence is left open.
+        '''
+        unregister_handle(self, 'allocator')
+        return self.report()
+
+
+def _allocator_afterfork(ref):
+    # The child runs a single thread, while the lock may be held by a thread of the parent
+    allocator = ref()
+
+    if allocator is not None:
+        allocator._lock = threading.Lock()
+        allocator._reset(forkgeneration())
+
+
+def _identity(value):
+    return value
+
+
+# Attributes of Db which the fast path closures depend on
+FASTPATH_ATTRS = frozenset(['keydump', 'datadump', 'dataload', 'capsule', '_metrics', '_bloom', '_idallocator'])
+
+
+def _delegates(cls):
+    '''Returns names of methods of cls which only pass the arguments to the same method of _cobj.
+    '''
+    names = []
+
+    for name, f in vars(cls).items():
+        code = getattr(f, '__code__', None)
+
+        if (code is not None and code.co_argcount == 1 and
+                code.co_names == ('_cobj', name) and
+                code.co_flags & inspect.CO_VARARGS and
+                code.co_flags & inspect.CO_VARKEYWORDS):
+            names.append(name)
+
+    return tuple(names)
+
+
+def _bind_delegates(obj, cls):
+    '''Sets the native methods as attributes of obj in place of the delegating methods of cls,
+    which saves a Python frame per call. Methods overridden by subclasses are kept.
+    '''
+    kind = type(obj)
+    attrs = obj.__dict__
+
+    for name in cls._delegated:
+        if getattr(kind, name) is getattr(cls, name):
+            method = getattr(obj._cobj, name, None)
+
+            if method is not None:
+                attrs[name] = method
+
+
+DbEnv._delegated = _delegates(DbEnv)
+Db._delegated = _delegates(Db)
+DbSequence._delegated = _delegates(DbSequence)
+
+
+class WriteBatch:
+    '''Buffers puts and deletes across databases of one environment and applies them in one transaction.
+    Operations are applied ordered by database and key, operations of the same key keep their order.
+    Used as context manager, the batch is committed on exit unless an exception is raised:
+
+        with dbenv.write_batch() as batch:
+            batch.put(db, key, data)
+            batch.delete(other_db, key)
+
+    If the environment has group commit enabled (DbEnv.set_group_commit), the transaction is committed without synchronous log flush, and the flush is shared with concurrent commits.
+    '''
+    def __init__(self, dbenv, txn=None):
+        self.dbenv = dbenv
+        self._parent = txn
+        self._ops = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.clear()
+
+    def __len__(self):
+        return len(self._ops)
+
+    def put(self, db, key, data, flags=0):
+        self._ops.append((db, db.keydump(key), key, data, flags))
+
+    def delete(self, db, key, flags=0):
+        self._ops.append((db, db.keydump(key), key, None, flags))
+
+    def clear(self):
+        self._ops = []
+
+    def commit(self):
+        '''Applies the buffered operations in one transaction.
+        '''
+        ops, self._ops = self._ops, []
+
+        if not ops:
+            return
+
+        names = {}
+
+        for op in ops:
+            db = op[0]
+
+            if id(db) not in names:
+                names[id(db)] = tuple(x or '' for x in db.get_dbname())
+
+        ops.sort(key=lambda op: (names[id(op[0])], op[1]))
+        group_commit = self.dbenv.group_commit if self._parent is None else None
+        txn = self.dbenv.txn_begin(self._parent)
+
+        try:
+            for db, rkey, key, data, flags in ops:
+                if data is None:
+                    db.delete(key, txn, flags)
+                else:
+                    db.put(key, data, txn, flags)
+        except:
+            txn.abort()
+            raise
+
+        if group_commit is None:
+            txn.commit()
+        else:
+            group_commit.commit(txn)
+
+
+class GroupCommit:
+    '''Merges log flushes of concurrent commits.
+    Transactions are committed without synchronous flush, then the first waiting thread becomes leader: it waits up to maxdelay seconds (or until maxbatch commits are waiting) and flushes the log once for all of them.
+    '''
+    def __init__(self, dbenv, maxdelay=0.002, maxbatch=64):
+        self.dbenv = dbenv
+        self.maxdelay = maxdelay
+        self.maxbatch = maxbatch
+        self.stats = {
+            'commits': 0,
+            'flushes': 0
+        }
+
+        self._cond = threading.Condition()
+        self._requested = 0
+        self._flushed = 0
+        self._leader = False
+        # Failed flushes: first ticket -> [last ticket, error, followers yet to be told]
+        self._errors = {}
+
+    def commit(self, txn):
+        txn.commit(DB_TXN_NOSYNC)
+        self.sync()
+
+    def sync(self):
+        '''Returns when the log is flushed up to this call.
+        '''
+        with self._cond:
+            self._requested += 1
+            ticket = self._requested
+            self.stats['commits'] += 1
+
+            if self._requested - self._flushed >= self.maxbatch:
+                self._cond.notify_all()
+
+            while self._flushed < ticket:
+                if not self._leader:
+                    self._leader = True
+                    break
+
+                self._cond.wait()
+            else:
+                return self._check(ticket)
+
+            # Leader collects the followers
+            deadline = perf_counter() + self.maxdelay
+
+            while self._requested - self._flushed < self.maxbatch:
+                remaining = deadline - perf_counter()
+
+                if remaining <= 0:
+                    break
+
+                self._cond.wait(remaining)
+
+            first = self._flushed + 1
+            target = self._requested
+
+        error = None
+
+        try:
+            self.dbenv.log_flush()
+        except Exception as e:
+            error = e
+
+        with self._cond:
+            self._flushed = target
+
+            # Every ticket of the batch but the leader's belongs to a waiting follower
+            if error and target > first:
+                self._errors[first] = [target, error, target - first]
+
+            self._leader = False
+            self.stats['flushes'] += 1
+            self._cond.notify_all()
+
+        if error:
+            raise error
+
+    def _check(self, ticket):
+        # Called under the condition lock by the followers
+        for first, failed in self._errors.items():
+            if first <= ticket <= failed[0]:
+                failed[2] -= 1
+
+                if not failed[2]:
+                    del self._errors[first]
+
+                raise failed[1]
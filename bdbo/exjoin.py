@@ -1,8 +1,10 @@
 # Extended equality join
 
+from time import perf_counter
 from types import MethodType
 from itertools import product
 from bdbo.db import *
+from bdbo import register_handle, unregister_handle
 
 
 def eqjkeys(keys, **sorts):
@@ -17,34 +19,34 @@ class DbExJoinMixin:
         self.exjoincursor = MethodType(DbExJoinCursor, self)
     
     def put(self, key, data, txn=None, flags=0, dlen=-1, doff=-1):
-        txn = self.dbenv.txn_begin(txn)
-
-        try:
-            if self.exjoin_db is not None:
-                self.exjoin_put(key, data, txn)
-            
-            ret = super().put(key, data, txn, flags, dlen, doff)
-        except:
-            txn.abort()
-            raise
-        else:
-            txn.commit()
-            return ret
+        if key is None and self._idallocator is not None:
+            key = self._idallocator.allocate()
+            self.put(key, data, txn, flags, dlen, doff)
+            return key
+
+        # Own transactions are retried on deadlock, nested ones are left to the caller
+        return self.dbenv.txn_run(self._exjoin_put_txn, key, data, flags, dlen, doff,
+                                  parent=txn,
+                                  attempts=None if txn is None else 1,
+                                  name='exjoin_put')
+
+    def _exjoin_put_txn(self, txn, key, data, flags, dlen, doff):
+        if self.exjoin_db is not None:
+            self.exjoin_put(key, data, txn)
+
+        return super().put(key, data, txn, flags, dlen, doff)
     
     def delete(self, key, txn=None, flags=0):
-        txn = self.dbenv.txn_begin(txn)
+        return self.dbenv.txn_run(self._exjoin_delete_txn, key, flags,
+                                  parent=txn,
+                                  attempts=None if txn is None else 1,
+                                  name='exjoin_delete')
 
-        try:
-            if self.exjoin_db is not None:
-                self.exjoin_delete(key, txn)
-
-            ret = super().delete(key, txn, flags)
-        except:
-            txn.abort()
-            raise
-        else:
-            txn.commit()
-            return ret
+    def _exjoin_delete_txn(self, txn, key, flags):
+        if self.exjoin_db is not None:
+            self.exjoin_delete(key, txn)
+
+        return super().delete(key, txn, flags)
     
     def cursor(self, txn=None, flags=0):
         raise NotImplementedError()
@@ -153,20 +155,26 @@ class DbExJoinMixin:
 
 
 class DbExJoinCursor:
-    __slots__ = ['db', 'counted', '_cursors', '_jcursor']
-
-    def __init__(self, db, keys, group, txn=None):
+    '''Equality join cursor of the records having all of the keys in the group.
+    Index cursors are opened with flags, DB_READ_COMMITTED by default. For the consistent
+    view pass the snapshot transaction (DbEnv.txn_begin_ctx(snapshot=True)) and flags=0;
+    the transaction is also used by DbExJoinCursor.fetch.
+    '''
+    __slots__ = ['db', 'counted', '_cursors', '_jcursor', '_txn', '__weakref__']
+
+    def __init__(self, db, keys, group, txn=None, flags=DB_READ_COMMITTED):
         self.db = db
         self.counted = 0
         self._cursors = []
         self._jcursor = None
+        self._txn = txn
 
         if db.exjoin_db is None:
             return
 
         for key in keys:
             rkey = db.keydump(group) + db.keydump(key)
-            cursor = db.exjoin_db._cobj.cursor(txn, DB_READ_COMMITTED)
+            cursor = db.exjoin_db._cobj.cursor(txn, flags)
 
             if cursor.set(rkey, dlen=0, doff=0):
                 self._cursors.append(cursor)
@@ -176,6 +184,7 @@ class DbExJoinCursor:
 
         if self._cursors:
             self._jcursor = db.exjoin_db._cobj.join(self._cursors)
+            register_handle(self, 'cursor')
             
     def __enter__(self):
         return self
@@ -184,6 +193,8 @@ class DbExJoinCursor:
         self.close()
 
     def close(self):
+        unregister_handle(self, 'cursor')
+
         if self._jcursor:
             self._jcursor.close()
 
@@ -212,6 +223,13 @@ class DbExJoinCursor:
     def fetch(self, count, txn=None):
         if not self._jcursor:
             return
+
+        if txn is None:
+            txn = self._txn
+
+        if self.db._metrics is not None:
+            yield from self._fetch_measured(count, txn)
+            return
         
         i = 0
         key = None
@@ -233,3 +251,36 @@ class DbExJoinCursor:
 
         self.counted += i + bool(key)
 
+    def _fetch_measured(self, count, txn):
+        db = self.db
+        call = decode = 0.0
+        items = 0
+        i = 0
+        key = None
+        t = perf_counter()
+
+        try:
+            for i in range(count):
+                key = self._jcursor.join_item()
+
+                if key:
+                    pkey = key.rsplit(b'@', 1)[1]
+                    data = db._cobj.get(pkey, txn=txn)
+
+                    if data:
+                        t1 = perf_counter()
+                        call += t1 - t
+                        value = db.capsule(db.dataload(data))
+                        decode += perf_counter() - t1
+                        items += 1
+                        yield value
+
+                        # Time of the consumer is not counted
+                        t = perf_counter()
+                else:
+                    break
+
+            call += perf_counter() - t
+            self.counted += i + bool(key)
+        finally:
+            db._metrics.observe(db._metricsname, 'joinfetch', 0.0, call, decode, items)
@@ -0,0 +1,181 @@
+import os
+import time
+import threading
+import warnings
+
+from bsddb3.db import *
+
+__all__ = [
+    'DbEnvMaintenance'
+]
+
+TASKS = ('checkpoint', 'trickle', 'archive')
+
+
+class DbEnvMaintenance:
+    '''Background checkpoint, cache trickle and log removal of the transactional DbEnv.
+    Every interval seconds the thread runs the tasks:
+        checkpoint - txn_checkpoint once checkpoint_kbytes of log were written
+                     or checkpoint_minutes passed since the last checkpoint
+        trickle - memp_trickle until trickle_percent of the cache pages are clean
+        archive - after a checkpoint, log files no longer needed for recovery are
+                  passed to the archive callable (if any) and removed
+
+    I/O is bounded by maxwrite: the cache writes at most maxwrite pages at once
+    and then sleeps maxwrite_sleep microseconds, see DB_ENV->set_mp_max_write.
+    Pass removelogs=False if the logs are needed for catastrophic recovery
+    and are archived by other means.
+    '''
+    def __init__(self, dbenv, interval=1, checkpoint_kbytes=16384, checkpoint_minutes=5,
+                 trickle_percent=20, maxwrite=None, maxwrite_sleep=10000,
+                 removelogs=True, archive=None):
+        self.dbenv = dbenv
+        self.interval = interval
+        self.checkpoint_kbytes = checkpoint_kbytes
+        self.checkpoint_minutes = checkpoint_minutes
+        self.trickle_percent = trickle_percent
+        self.maxwrite = maxwrite
+        self.maxwrite_sleep = maxwrite_sleep
+        self.removelogs = removelogs
+        self.archive = archive
+
+        # Runs are serialized by _runlock, _lock only guards the counters
+        self._lock = threading.Lock()
+        self._runlock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = {
+                'runs': 0,
+                'checkpoints': 0,
+                'pages_trickled': 0,
+                'logs_removed': 0,
+                'errors': 0,
+                'tasks': {task: {'count': 0, 'seconds': 0.0, 'last': 0.0, 'max': 0.0}
+                          for task in TASKS}
+            }
+
+    def _timed(self, task, function, *args):
+        started = time.perf_counter()
+
+        try:
+            return function(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+
+            with self._lock:
+                record = self._stats['tasks'][task]
+                record['count'] += 1
+                record['seconds'] += elapsed
+                record['last'] = elapsed
+                record['max'] = max(record['max'], elapsed)
+
+    def checkpoint(self, force=False):
+        '''Checkpoints if the thresholds are reached, returns True if the checkpoint was taken.
+        '''
+        before = self.dbenv.txn_stat().get('last_ckp')
+
+        if force:
+            self.dbenv.txn_checkpoint(0, 0, DB_FORCE)
+        else:
+            self.dbenv.txn_checkpoint(self.checkpoint_kbytes, self.checkpoint_minutes)
+
+        return self.dbenv.txn_stat().get('last_ckp') != before
+
+    def trickle(self):
+        '''Writes dirty cache pages up to trickle_percent clean ones, returns number of pages written.
+        '''
+        return self.dbenv.memp_trickle(self.trickle_percent)
+
+    def remove_logs(self):
+        '''Removes log files which are not needed for the normal recovery, returns their list.
+        Only the listed files are removed, after the archive callable took them: logs which
+        became removable in the meantime wait for the next run.
+        '''
+        files = self.dbenv.log_archive(DB_ARCH_ABS)
+
+        if files and self.archive is not None:
+            self.archive(files)
+
+        for path in files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        return files
+
+    def run(self, force=False):
+        '''Runs the tasks once.
+        '''
+        with self._runlock:
+            checkpointed = self._timed('checkpoint', self.checkpoint, force)
+            trickled = self._timed('trickle', self.trickle)
+            removed = 0
+
+            if checkpointed and self.removelogs:
+                removed = len(self._timed('archive', self.remove_logs))
+
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['checkpoints'] += checkpointed
+            self._stats['pages_trickled'] += trickled
+            self._stats['logs_removed'] += removed
+
+    def stats(self):
+        '''Returns dict of the task counters and timings, the I/O budget and pending log volume:
+            log_kbytes_since_checkpoint
+            dirty_pages
+            maxwrite - (pages, sleep microseconds) or None
+        '''
+        with self._lock:
+            stats = dict(self._stats, tasks={k: dict(v) for k, v in self._stats['tasks'].items()})
+
+        log = self.dbenv.log_stat()
+        stats['log_kbytes_since_checkpoint'] = log.get('wc_mbytes', 0) * 1024 + log.get('wc_bytes', 0) // 1024
+        stats['dirty_pages'] = self.dbenv.memp_stat()[0].get('page_dirty', 0)
+        stats['maxwrite'] = (self.maxwrite, self.maxwrite_sleep) if self.maxwrite else None
+        stats['interval'] = self.interval
+
+        return stats
+
+    def start(self):
+        '''Starts the background maintenance thread.
+        '''
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        if self.maxwrite:
+            self.dbenv.set_mp_max_write(self.maxwrite, self.maxwrite_sleep)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop,
+                                        name='DbEnvMaintenance',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, checkpoint=True):
+        '''Stops the thread, by default with the final forced checkpoint.
+        '''
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+        if checkpoint:
+            self.run(force=True)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run()
+            except DBError:
+                with self._lock:
+                    self._stats['errors'] += 1
+
+                warnings.warn('DbEnvMaintenance run failed', RuntimeWarning)
@@ -0,0 +1,192 @@
+import os
+import math
+import threading
+import warnings
+
+__all__ = [
+    'Histogram',
+    'DbMetrics',
+    'PrometheusExporter'
+]
+
+# Buckets are powers of two microseconds, the last one is +Inf
+NBUCKETS = 28
+PHASES = ('encode', 'call', 'decode', 'total')
+
+
+class Histogram:
+    '''Latency histogram with log2 buckets, from 1 microsecond to ~67 seconds.
+    Updates are not locked, concurrent threads may rarely lose an update.
+    '''
+    __slots__ = ['counts', 'count', 'sum']
+
+    def __init__(self):
+        self.counts = [0] * NBUCKETS
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        # Upper bounds are inclusive: 2 ** i microseconds fall in bucket i
+        index = max(math.ceil(seconds * 1e6) - 1, 0).bit_length()
+        self.counts[index if index < NBUCKETS else NBUCKETS - 1] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def bounds(self):
+        '''Returns upper bounds of buckets in seconds.
+        '''
+        return [2 ** i / 1e6 for i in range(NBUCKETS - 1)] + [float('inf')]
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': list(zip(self.bounds(), self.counts))
+        }
+
+
+class DbMetrics:
+    '''Per-database operation counters and phase latency histograms.
+    Phases of an operation:
+        encode - key packing and value serialization
+        call - the bsddb3 call, including lock waits and I/O
+        decode - value deserialization and capsule
+        total
+    '''
+    def __init__(self):
+        self._ops = {}
+
+    def _op(self, db, op):
+        try:
+            return self._ops[db, op]
+        except KeyError:
+            return self._ops.setdefault((db, op), {
+                'count': 0,
+                'items': 0,
+                'errors': 0,
+                'phases': {phase: Histogram() for phase in PHASES}
+            })
+
+    def observe(self, db, op, encode, call, decode, items=1):
+        '''Records an operation, phases are given in seconds.
+        '''
+        record = self._op(db, op)
+        record['count'] += 1
+        record['items'] += items
+        phases = record['phases']
+        phases['encode'].observe(encode)
+        phases['call'].observe(call)
+        phases['decode'].observe(decode)
+        phases['total'].observe(encode + call + decode)
+
+    def error(self, db, op):
+        self._op(db, op)['errors'] += 1
+
+    def reset(self):
+        self._ops = {}
+
+    def snapshot(self):
+        '''Returns dict of database name -> operation -> counters and histogram snapshots.
+        '''
+        result = {}
+
+        for (db, op), record in list(self._ops.items()):
+            result.setdefault(db, {})[op] = {
+                'count': record['count'],
+                'items': record['items'],
+                'errors': record['errors'],
+                'phases': {k: v.snapshot() for k, v in record['phases'].items()}
+            }
+
+        return result
+
+    def prometheus(self, prefix='bdbo_db'):
+        '''Returns the metrics in Prometheus text exposition format.
+        '''
+        lines = []
+        snapshot = self.snapshot()
+
+        for name, key in (('ops_total', 'count'),
+                          ('items_total', 'items'),
+                          ('errors_total', 'errors')):
+            lines.append('# TYPE %s_%s counter' % (prefix, name))
+
+            for db, ops in sorted(snapshot.items()):
+                for op, record in sorted(ops.items()):
+                    lines.append('%s_%s{db="%s",op="%s"} %i' % (
+                        prefix, name, _escape(db), op, record[key]))
+
+        lines.append('# TYPE %s_op_seconds histogram' % prefix)
+
+        for db, ops in sorted(snapshot.items()):
+            for op, record in sorted(ops.items()):
+                for phase, hist in sorted(record['phases'].items()):
+                    labels = 'db="%s",op="%s",phase="%s"' % (_escape(db), op, phase)
+                    cumulative = 0
+
+                    for bound, count in hist['buckets']:
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append('%s_op_seconds_bucket{%s,le="%s"} %i' % (
+                            prefix, labels, le, cumulative))
+
+                    lines.append('%s_op_seconds_sum{%s} %r' % (prefix, labels, hist['sum']))
+                    lines.append('%s_op_seconds_count{%s} %i' % (prefix, labels, hist['count']))
+
+        return '\n'.join(lines) + '\n'
+
+    def export(self, target):
+        '''Writes Prometheus text to the file path (atomically replaced) or passes it to the callable.
+        '''
+        text = self.prometheus()
+
+        if callable(target):
+            target(text)
+        else:
+            tmp = target + '.tmp'
+
+            with open(tmp, 'w') as f:
+                f.write(text)
+
+            os.replace(tmp, target)
+
+
+class PrometheusExporter:
+    '''Periodically exports DbMetrics to the file or callable, see DbMetrics.export.
+    '''
+    def __init__(self, metrics, target, interval=15):
+        self.metrics = metrics
+        self.target = target
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop,
+                                        name='PrometheusExporter',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.metrics.export(self.target)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.metrics.export(self.target)
+            except Exception:
+                warnings.warn('Metrics export failed', RuntimeWarning)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,289 @@
+import os
+import time
+import warnings
+import itertools
+import threading
+import multiprocessing
+
+from bsddb3.db import *
+from .db import DbEnv, Db
+
+__all__ = [
+    'DbReplicaSet',
+    'DbReplicaReader'
+]
+
+REP_ENV_FLAGS = (DB_CREATE | DB_RECOVER | DB_THREAD | DB_INIT_REP | DB_INIT_LOCK |
+                 DB_INIT_LOG | DB_INIT_MPOOL | DB_INIT_TXN)
+
+MASTER_EID = 1
+
+
+class _Link:
+    '''Pipe connection shared by threads.
+    '''
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        with self.lock:
+            self.conn.send(message)
+
+    def request(self, message):
+        with self.lock:
+            self.conn.send(message)
+            return self.conn.recv()
+
+
+def _receive(dbenv, link, eid):
+    '''Passes replication messages from the link to the environment until the link is closed.
+    '''
+    while True:
+        try:
+            control, rec = link.conn.recv()
+        except (EOFError, OSError):
+            return
+
+        try:
+            dbenv.rep_process_message(control, rec, eid)
+        except DBError:
+            warnings.warn('Replication message from %i failed' % eid, RuntimeWarning)
+
+
+def _lsn(dbenv):
+    stat = dbenv.log_stat()
+    return stat['cur_file'], stat['cur_offset']
+
+
+def _replica(home, eid, repconn, reqconn, cachesize):
+    '''Process of the replica environment: applies the replication messages of the master
+    and serves the read requests of DbReplicaReader with raw keys and values.
+    '''
+    link = _Link(repconn)
+
+    def send(dbenv, control, rec, lsn, envid, flags):
+        # Replicas only talk to the master
+        link.send((control, rec))
+        return 0
+
+    dbenv = DbEnv()
+    dbenv.set_cachesize(0, cachesize, 1)
+    dbenv.rep_set_transport(eid, send)
+    dbenv.open(home, REP_ENV_FLAGS)
+    dbenv.rep_set_priority(0)
+    dbenv.rep_start(None, DB_REP_CLIENT)
+
+    receiver = threading.Thread(target=_receive, args=(dbenv, link, MASTER_EID), daemon=True)
+    receiver.start()
+    dbs = {}
+
+    def database(filename, dbname):
+        try:
+            return dbs[filename, dbname]
+        except KeyError:
+            db = Db(dbenv)
+            # Requests carry encoded keys
+            db.keydump = bytes
+            db.open(filename, dbname, DB_UNKNOWN, DB_RDONLY | DB_THREAD)
+            return dbs.setdefault((filename, dbname), db)
+
+    try:
+        while True:
+            try:
+                message = reqconn.recv()
+            except EOFError:
+                break
+
+            op = message[0]
+
+            try:
+                if op == 'stop':
+                    reqconn.send(('ok', None))
+                    break
+                elif op == 'lsn':
+                    result = _lsn(dbenv)
+                elif op == 'get':
+                    result = database(*message[1:3])._cobj.get(message[3])
+                elif op == 'exists':
+                    result = database(*message[1:3])._cobj.exists(message[3])
+                elif op == 'fetchraw':
+                    filename, dbname, begin, end, count = message[1:]
+
+                    with database(filename, dbname).rangecursor(begin, end) as cursor:
+                        result = list(cursor.fetchraw(count))
+                else:
+                    raise ValueError('Unknown request %r' % op)
+            except Exception as e:
+                reqconn.send(('error', e))
+            else:
+                reqconn.send(('ok', result))
+    finally:
+        for db in dbs.values():
+            db.close()
+
+        dbenv.close()
+
+
+class DbReplicaSet:
+    '''Master DbEnv in this process and read-only replica environments in child processes,
+    replicated through rep_set_transport over pipes, all on the local machine:
+
+        replicas = DbReplicaSet(home, 2)
+        db = Db(replicas.master)
+        db.open('data.db', None, DB_BTREE, DB_CREATE | DB_AUTO_COMMIT)
+        db.put(key, data)
+        replicas.wait()
+        reader = replicas.reader(db)
+        reader.get(key)
+
+    Environments are kept in home/master and home/replicaNN. Writes go to the master,
+    reads of DbReplicaReader are spread round-robin over the replicas, which may lag behind
+    the master, see DbReplicaSet.lag.
+    '''
+    def __init__(self, home, replicas=2, cachesize=32*1024*1024):
+        self.home = home
+        self._links = {}
+        self._requests = []
+        self._processes = []
+
+        pipes = []
+
+        for i in range(replicas):
+            eid = MASTER_EID + 1 + i
+            repconn, child_repconn = multiprocessing.Pipe()
+            reqconn, child_reqconn = multiprocessing.Pipe()
+            self._links[eid] = _Link(repconn)
+            self._requests.append(_Link(reqconn))
+            pipes.append((eid, child_repconn, child_reqconn))
+
+        masterhome = os.path.join(home, 'master')
+        os.makedirs(masterhome, exist_ok=True)
+
+        self.master = DbEnv()
+        self.master.set_cachesize(0, cachesize, 1)
+        self.master.rep_set_transport(MASTER_EID, self._send)
+        self.master.open(masterhome, REP_ENV_FLAGS)
+        self.master.rep_start(None, DB_REP_MASTER)
+
+        for eid, link in self._links.items():
+            threading.Thread(target=_receive, args=(self.master, link, eid), daemon=True).start()
+
+        for eid, child_repconn, child_reqconn in pipes:
+            replicahome = os.path.join(home, 'replica%02i' % (eid - MASTER_EID - 1))
+            os.makedirs(replicahome, exist_ok=True)
+            process = multiprocessing.Process(target=_replica,
+                                              args=(replicahome, eid, child_repconn, child_reqconn, cachesize),
+                                              daemon=True)
+            process.start()
+            self._processes.append(process)
+
+        self.reads = [0] * replicas
+
+    def _send(self, dbenv, control, rec, lsn, envid, flags):
+        links = self._links.values() if envid == DB_EID_BROADCAST else [self._links[envid]]
+
+        for link in links:
+            try:
+                link.send((control, rec))
+            except (BrokenPipeError, OSError):
+                warnings.warn('Replica link is closed', RuntimeWarning)
+
+        return 0
+
+    def request(self, index, *message):
+        '''Sends the request to the replica and returns the result, see _replica.
+        '''
+        status, result = self._requests[index].request(message)
+
+        if status == 'error':
+            raise result
+
+        self.reads[index] += 1
+        return result
+
+    def reader(self, db):
+        return DbReplicaReader(self, db)
+
+    def lag(self):
+        '''Returns list of replicas log positions and how many log bytes each one is behind the master.
+        '''
+        mfile, moffset = _lsn(self.master)
+        lgmax = self.master.get_lg_max()
+        result = []
+
+        for index in range(len(self._requests)):
+            rfile, roffset = self.request(index, 'lsn')
+            result.append({
+                'replica': index,
+                'lsn': (rfile, roffset),
+                'lag_bytes': max((mfile - rfile) * lgmax + moffset - roffset, 0)
+            })
+
+        return result
+
+    def wait(self, timeout=10, interval=0.01):
+        '''Waits until all replicas caught up with the master, returns False on timeout.
+        '''
+        deadline = time.time() + timeout
+
+        while any(r['lag_bytes'] for r in self.lag()):
+            if time.time() > deadline:
+                return False
+
+            time.sleep(interval)
+
+        return True
+
+    def stats(self):
+        return {
+            'replicas': len(self._requests),
+            'reads': list(self.reads),
+            'lag': self.lag()
+        }
+
+    def close(self):
+        for index, link in enumerate(self._requests):
+            try:
+                link.request(('stop',))
+            except (EOFError, OSError):
+                pass
+
+        for process in self._processes:
+            process.join()
+
+        for link in list(self._links.values()) + self._requests:
+            link.conn.close()
+
+        self.master.close()
+
+
+class DbReplicaReader:
+    '''Read-only operations of the master database served by the replicas in turn.
+    Keys and values are encoded and decoded by the master Db handle.
+    '''
+    def __init__(self, replicaset, db):
+        self.replicaset = replicaset
+        self.db = db
+        self._name = db.get_dbname()
+        self._turn = itertools.count()
+
+    def _next(self):
+        return next(self._turn) % len(self.replicaset.reads)
+
+    def get(self, key, default=None):
+        db = self.db
+        rdata = self.replicaset.request(self._next(), 'get', *self._name, db.keydump(key))
+        return db.capsule(db.dataload(rdata)) if rdata else default
+
+    def exists(self, key):
+        return self.replicaset.request(self._next(), 'exists', *self._name, self.db.keydump(key))
+
+    def fetch(self, begin, end=None, count=100):
+        '''Returns list of up to count values of the range, see DbRangeCursor.
+        '''
+        db = self.db
+        begin = db.keydump(begin)
+        end = None if end is None else db.keydump(end)
+        records = self.replicaset.request(self._next(), 'fetchraw', *self._name, begin, end, count)
+        return [db.capsule(db.dataload(rdata)) for rkey, rdata in records]
@@ -0,0 +1,170 @@
+import sys
+import heapq
+
+from zlib import crc32
+from itertools import islice
+from operator import itemgetter
+
+from bsddb3.db import *
+from .db import Db
+
+__all__ = [
+    'ShardedDb',
+    'ShardedRangeCursor'
+]
+
+OPS = ('get', 'put', 'delete', 'exists')
+
+
+class ShardedDb:
+    '''Database spread over several Db by crc32 of the encoded key, with the interface of Db.
+    The shards must use the same key codec and serializer, and their number must not change
+    for existing data. Range queries run a cursor per shard and merge them in key order,
+    see ShardedDb.rangecursor.
+    '''
+    def __init__(self, shards):
+        if not shards:
+            raise ValueError('At least one shard is required')
+
+        self.shards = list(shards)
+        self._keydump = self.shards[0].keydump
+        self._routed = {op: [0] * len(self.shards) for op in OPS}
+
+    @classmethod
+    def open(cls, dbenvs, filename, shards, dbtype=DB_BTREE, flags=DB_CREATE, mode=0o660, dbclass=Db):
+        '''Opens shards files "filename.NNN", spread round-robin over the environments.
+        dbenvs is a DbEnv or list of them.
+        '''
+        if not isinstance(dbenvs, (list, tuple)):
+            dbenvs = [dbenvs]
+
+        dbs = []
+
+        for i in range(shards):
+            db = dbclass(dbenvs[i % len(dbenvs)])
+            db.open('%s.%03i' % (filename, i), None, dbtype, flags, mode)
+            dbs.append(db)
+
+        return cls(dbs)
+
+    def shard_of(self, key):
+        '''Returns the index of the shard of the key.
+        '''
+        return crc32(self._keydump(key)) % len(self.shards)
+
+    def _route(self, op, key):
+        index = crc32(self._keydump(key)) % len(self.shards)
+        self._routed[op][index] += 1
+        return self.shards[index]
+
+    def get(self, key, default=None, txn=None, flags=0, dlen=-1, doff=-1):
+        return self._route('get', key).get(key, default, txn, flags, dlen, doff)
+
+    def put(self, key, data, txn=None, flags=0, dlen=-1, doff=-1):
+        return self._route('put', key).put(key, data, txn, flags, dlen, doff)
+
+    def delete(self, key, txn=None, flags=0):
+        return self._route('delete', key).delete(key, txn, flags)
+
+    def exists(self, key, txn=None, flags=0):
+        return self._route('exists', key).exists(key, txn, flags)
+
+    def rangecursor(self, begin, end=None, txn=None, flags=0):
+        return ShardedRangeCursor(self, begin, end, txn, flags)
+
+    def set_metrics(self, metrics, name=None):
+        '''Enables metrics of every shard named "name#N", see Db.set_metrics.
+        '''
+        for i, db in enumerate(self.shards):
+            if metrics is None:
+                db.set_metrics(None)
+            else:
+                filename, dbname = db.get_dbname()
+                db.set_metrics(metrics, '%s#%i' % (name or filename, i))
+
+    def stats(self):
+        '''Returns per-shard operation counts of the routing and the skew of each operation:
+        the busiest shard count over the mean one, 1.0 is an even spread.
+        '''
+        routed = {op: list(counts) for op, counts in self._routed.items()}
+        skew = {}
+
+        for op, counts in routed.items():
+            mean = sum(counts) / len(counts)
+            skew[op] = max(counts) / mean if mean else 1.0
+
+        return {
+            'shards': len(self.shards),
+            'routed': routed,
+            'skew': skew
+        }
+
+    def sync(self):
+        for db in self.shards:
+            db.sync()
+
+    def close(self):
+        for db in self.shards:
+            db.close()
+
+
+class ShardedRangeCursor:
+    '''Range cursor over all shards: a DbRangeCursor per shard, merged by key.
+    '''
+    def __init__(self, sdb, begin, end=None, txn=None, flags=0):
+        self.sdb = sdb
+        self._cursors = [db.rangecursor(begin, end, txn, flags) for db in sdb.shards]
+        self._merged = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        for cursor in self._cursors:
+            cursor.close()
+
+    def set(self, begin, end=None):
+        for cursor in self._cursors:
+            cursor.set(begin, end)
+
+        self._merged = None
+        return self
+
+    def first(self):
+        for cursor in self._cursors:
+            cursor.first()
+
+        self._merged = None
+        return self
+
+    def total(self):
+        '''Number of records of the range, the shards must be DB_RECNUM, see DbRangeCursor.total.
+        '''
+        self._merged = None
+        return sum(cursor.total() for cursor in self._cursors)
+
+    def _merge(self):
+        if self._merged is None:
+            # Shards are tagged to decode the records by their own serializer
+            streams = [_tagged(cursor, db) for cursor, db in zip(self._cursors, self.sdb.shards)]
+            self._merged = heapq.merge(*streams, key=itemgetter(0))
+
+        return self._merged
+
+    def fetchraw(self, count):
+        '''Yields up to count (rkey, rdata) records of all shards in key order.
+        '''
+        for rkey, rdata, db in islice(self._merge(), count):
+            yield rkey, rdata
+
+    def fetch(self, count):
+        for rkey, rdata, db in islice(self._merge(), count):
+            yield db.capsule(db.dataload(rdata))
+
+
+def _tagged(cursor, db):
+    for rkey, rdata in cursor.fetchraw(sys.maxsize):
+        yield rkey, rdata, db
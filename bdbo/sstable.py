@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import mmap
+import struct
+
+from bisect import bisect_right
+from bsddb3.db import *
+
+from .util import lexpacker
+
+__all__ = [
+    'export',
+    'SSTable'
+]
+
+# Header: magic, version, reserved, records per block, number of records, offset of the record offsets
+HEADER = struct.Struct('<4s H H I Q Q')
+MAGIC = b'BDS1'
+VERSION = 1
+
+# Record: key length, value length, then the key and the value
+RECORD = struct.Struct('<I I')
+OFFSET = struct.Struct('<Q')
+
+
+def export(db, path, begin=None, end=None, txn=None, blockrecords=64):
+    '''Writes the records of the range of db (all of them if begin is None) to the sorted table file.
+    Records are written as stored in db, so SSTable decodes them with the serializer of db.
+    The file is written aside and renamed, readers of the previous file keep their mapping.
+    Returns the number of records. The keys must be bytes, so db must be a BTREE or HASH.
+    '''
+    if db.get_type() in (DB_RECNO, DB_QUEUE):
+        raise ValueError('Sorted tables require a BTREE or HASH database')
+
+    tmp = path + '.tmp'
+    offsets = []
+
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, blockrecords, 0, 0))
+            position = HEADER.size
+
+            if begin is None:
+                cursor = db._cobj.cursor(txn)
+
+                def records():
+                    record = cursor.first()
+
+                    while record:
+                        yield record
+                        record = cursor.next()
+            else:
+                cursor = db.rangecursor(begin, end, txn)
+
+                def records():
+                    return cursor.fetchraw(sys.maxsize)
+
+            try:
+                for rkey, rdata in records():
+                    offsets.append(position)
+                    f.write(RECORD.pack(len(rkey), len(rdata)))
+                    f.write(rkey)
+                    f.write(rdata)
+                    position += RECORD.size + len(rkey) + len(rdata)
+            finally:
+                cursor.close()
+
+            for offset in offsets:
+                f.write(OFFSET.pack(offset))
+
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, 0, blockrecords, len(offsets), position))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp, path)
+    except BaseException:
+        # The file of a failed export is never left behind
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+        raise
+
+    return len(offsets)
+
+
+class SSTable:
+    '''Read-only sorted table written by export, memory-mapped and shared by processes through the page cache.
+    Lookups bisect the in-memory first keys of blocks of records, then the record offsets of the block
+    in the mapping, so they do no system calls. Keys are encoded and values decoded by keydump, dataload
+    and capsule of db if given, otherwise by lexpacker and json.loads.
+    '''
+    def __init__(self, path, db=None):
+        if db is None:
+            self.keydump = lexpacker()[0]
+            self.dataload = json.loads
+            self.capsule = None
+        else:
+            self.keydump = db.keydump
+            self.dataload = db.dataload
+            self.capsule = db.capsule
+
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._view = memoryview(self._mmap)
+        magic, version, reserved, self._blockrecords, self._count, self._offsets = HEADER.unpack_from(self._view)
+
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('Not a sorted table file: %s' % path)
+
+        self._firstkeys = [self._key(self._offset(i)) for i in range(0, self._count, self._blockrecords)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, key):
+        return self.getraw(self.keydump(key)) is not None
+
+    def close(self):
+        '''Releases the mapping. The memoryviews returned by getraw, rangeraw and prefix keep
+        the file mapped until they are released, then it is unmapped with the last of them.
+        '''
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Values of the caller still refer to the mapping
+                pass
+
+            self._mmap = None
+
+    def _offset(self, index):
+        return OFFSET.unpack_from(self._view, self._offsets + index * OFFSET.size)[0]
+
+    def _key(self, offset):
+        klen, vlen = RECORD.unpack_from(self._view, offset)
+        start = offset + RECORD.size
+        return self._mmap[start:start + klen]
+
+    def _lowerbound(self, rkey):
+        '''Returns index of the first record with key >= rkey.
+        '''
+        block = bisect_right(self._firstkeys, rkey) - 1
+
+        if block < 0:
+            return 0
+
+        lo = block * self._blockrecords
+        hi = min(lo + self._blockrecords, self._count)
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+
+            if self._key(self._offset(mid)) < rkey:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def _record(self, index):
+        '''Returns (rkey, value memoryview) of the record.
+        '''
+        offset = self._offset(index)
+        klen, vlen = RECORD.unpack_from(self._view, offset)
+        start = offset + RECORD.size
+        return self._mmap[start:start + klen], self._view[start + klen:start + klen + vlen]
+
+    def _decode(self, rdata):
+        value = self.dataload(bytes(rdata))
+        return value if self.capsule is None else self.capsule(value)
+
+    def getraw(self, rkey):
+        '''Returns memoryview of the stored value of the encoded key, or None.
+        '''
+        index = self._lowerbound(rkey)
+
+        if index < self._count:
+            key, rdata = self._record(index)
+
+            if key == rkey:
+                return rdata
+
+        return None
+
+    def get(self, key, default=None):
+        rdata = self.getraw(self.keydump(key))
+        return default if rdata is None else self._decode(rdata)
+
+    def rangeraw(self, begin, end):
+        '''Yields (rkey, value memoryview) of the records with begin <= rkey <= end.
+        '''
+        for index in range(self._lowerbound(begin), self._count):
+            rkey, rdata = self._record(index)
+
+            if rkey > end:
+                break
+
+            yield rkey, rdata
+
+    def range(self, begin, end=None):
+        '''Yields values of the key range, with the bounds of DbRangeCursor: without end,
+        the records whose keys extend begin.
+        '''
+        begin = self.keydump(begin)
+
+        if end is None:
+            end = begin[:-1] + b'~'
+        else:
+            end = self.keydump(end)
+
+            if begin > end:
+                end = end[:-1] + b'~'
+
+        for rkey, rdata in self.rangeraw(begin, end):
+            yield self._decode(rdata)
+
+    def prefix(self, prefix):
+        '''Yields (rkey, value memoryview) of the records whose encoded keys start with the bytes prefix.
+        '''
+        for index in range(self._lowerbound(prefix), self._count):
+            rkey, rdata = self._record(index)
+
+            if not rkey.startswith(prefix):
+                break
+
+            yield rkey, rdata
@@ -0,0 +1,176 @@
+import time
+import threading
+import warnings
+
+from collections import deque
+from bsddb3.db import *
+
+__all__ = [
+    'DbEnvSampler'
+]
+
+# Sample name -> (stat function, counter keys). Keys are summed, as
+# the libraries of different versions name some counters differently.
+COUNTERS = {
+    'cache_hits': ('memp', ('cache_hit',)),
+    'cache_misses': ('memp', ('cache_miss',)),
+    'page_evictions': ('memp', ('ro_evict', 'rw_evict')),
+    'lock_requests': ('lock', ('nrequests',)),
+    'lock_waits': ('lock', ('lock_wait', 'nconflicts')),
+    'deadlocks': ('lock', ('ndeadlocks',)),
+    'lock_timeouts': ('lock', ('nlocktimeouts',)),
+    'begins': ('txn', ('nbegins',)),
+    'commits': ('txn', ('ncommits',)),
+    'aborts': ('txn', ('naborts',)),
+    'log_writes': ('log', ('wcount',)),
+    'log_flushes': ('log', ('scount',)),
+    'mutex_waits': ('mutex', ('region_wait',)),
+}
+
+
+class DbEnvSampler:
+    '''Periodically snapshots the cumulative DbEnv statistics and keeps per-interval rates in a ring buffer.
+    Each sample has the per-second rate of every name of COUNTERS, plus:
+        timestamp
+        interval
+        hitrate - cache hit rate of the interval
+        log_bytes - log bytes written per second
+        active_txns
+        anomalies - list of names, see DbEnvSampler.detect
+    '''
+    def __init__(self, dbenv, interval=5, size=720, spike=3.0, minwaits=10, callback=None):
+        self.dbenv = dbenv
+        self.interval = interval
+        self.spike = spike
+        self.minwaits = minwaits
+        self.callback = callback
+
+        self._ring = deque(maxlen=size)
+        self._ringlock = threading.Lock()
+        self._previous = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _stats(self):
+        stats = {}
+
+        for name, method in (('memp', lambda: self.dbenv.memp_stat()[0]),
+                             ('lock', self.dbenv.lock_stat),
+                             ('txn', self.dbenv.txn_stat),
+                             ('log', self.dbenv.log_stat),
+                             ('mutex', self.dbenv.mutex_stat)):
+            # Subsystems which are not initialized are skipped
+            try:
+                stats[name] = method()
+            except DBError:
+                stats[name] = {}
+
+        counters = {}
+
+        for name, (group, keys) in COUNTERS.items():
+            counters[name] = sum(stats[group].get(k, 0) for k in keys)
+
+        log = stats['log']
+        counters['log_bytes'] = log.get('w_mbytes', 0) * 1024 * 1024 + log.get('w_bytes', 0)
+
+        return counters, stats['txn'].get('nactive', 0)
+
+    def sample(self):
+        '''Takes a snapshot and returns the sample of the interval since the previous one.
+        The first call only remembers the snapshot and returns None.
+        '''
+        timestamp = time.time()
+        counters, active = self._stats()
+        previous = self._previous
+        self._previous = (timestamp, counters)
+
+        if previous is None:
+            return None
+
+        interval = (timestamp - previous[0]) or 1e-9
+        sample = {
+            'timestamp': timestamp,
+            'interval': interval,
+            'active_txns': active
+        }
+
+        for name, value in counters.items():
+            # Counters drop when the statistics are reset
+            sample[name] = max(value - previous[1][name], 0) / interval
+
+        hits, misses = sample['cache_hits'], sample['cache_misses']
+        sample['hitrate'] = hits / ((hits + misses) or 1)
+        sample['anomalies'] = self.detect(sample)
+
+        with self._ringlock:
+            self._ring.append(sample)
+
+        if sample['anomalies'] and self.callback is not None:
+            self.callback(sample)
+
+        return sample
+
+    def detect(self, sample):
+        '''Returns list of anomalies of the sample against the buffered ones:
+            lock_wait_spike - lock waits rate exceeds the mean by spike times
+            deadlocks
+            lock_timeouts
+        '''
+        anomalies = []
+        recent = self.samples()
+
+        if recent:
+            mean = sum(s['lock_waits'] for s in recent) / len(recent)
+            waits = sample['lock_waits']
+
+            if waits >= self.minwaits and waits > mean * self.spike:
+                anomalies.append('lock_wait_spike')
+
+        if sample['deadlocks']:
+            anomalies.append('deadlocks')
+
+        if sample['lock_timeouts']:
+            anomalies.append('lock_timeouts')
+
+        return anomalies
+
+    def samples(self, count=None):
+        '''Returns list of the recent samples, the oldest first.
+        '''
+        with self._ringlock:
+            samples = list(self._ring)
+
+        return samples[-count:] if count else samples
+
+    def latest(self):
+        with self._ringlock:
+            return self._ring[-1] if self._ring else None
+
+    def start(self):
+        '''Starts the background sampling thread.
+        '''
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop,
+                                        name='DbEnvSampler',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _loop(self):
+        self.sample()
+
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except DBError:
+                warnings.warn('DbEnvSampler sample failed', RuntimeWarning)
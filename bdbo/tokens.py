@@ -22,26 +22,46 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import os
+import hmac
 import time
+import zlib
 import struct
+import hashlib
 import marshal
 import warnings
+import threading
 
 from os import urandom
 from binascii import hexlify, unhexlify
 
 from bsddb3.db import *
-from . import register_close_handler
+from . import register_handle, unregister_handle
+from .util import forkgeneration, BloomFilter
 
 __all__ = [
     'DbTokens',
+    'DbShardedTokens',
     'TokenError',
     'TokenInvalidError',
     'TokenExpiredError',
     'TokenNotFoundError',
+    'KeySource',
     'urandompool'
 ]
 
+# First byte of the record header. Legacy records begin with the length
+# of the key as pascal string, which never reaches this value.
+RECORD_MAGIC = 0xFF
+RECORD_VERSION = 1
+
+# Length of the truncated HMAC-SHA256 digest of signed tokens
+SIGNATURE_LEN = 16
+
+# Shard prefix of DbShardedTokens tokens
+HEXDIGITS = frozenset('0123456789abcdefABCDEF')
+
+
 class TokenError(Exception): pass
 class TokenInvalidError(TokenError): pass
 class TokenExpiredError(TokenError): pass
@@ -62,6 +82,32 @@ def urandompool(length, pool):
         index += length
 
 
+class KeySource:
+    '''Iterator of random keys, safe to share between threads.
+    Every thread takes keys from its own buffer of urandom bytes, refilled by length * pool bytes at a time.
+    The buffers are dropped in a child process after fork, so parent and child never share keys.
+    '''
+    def __init__(self, length, pool=500):
+        self.length = length
+        self.chunksize = length * pool
+        self._local = threading.local()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        local = self._local
+        index = getattr(local, 'index', self.chunksize)
+
+        if index == self.chunksize or local.generation != forkgeneration():
+            local.buffer = urandom(self.chunksize)
+            local.generation = forkgeneration()
+            index = 0
+
+        local.index = index + self.length
+        return local.buffer[index:index+self.length]
+
+
 class DbTokens:
     def __init__(self,
                  dbdir,
@@ -70,6 +116,11 @@ class DbTokens:
                  pagesize=8192,
                  maxgrouptokens=50,
                  refreshtime=2,
+                 sweepbatch=100,
+                 sweepinterval=60,
+                 sweeprate=1000,
+                 signed=False,
+                 revocations=10000,
                  dumps=marshal.dumps,
                  loads=marshal.loads):
 
@@ -78,45 +129,165 @@ class DbTokens:
 
         self.dbenv = DBEnv()
         self.dbenv.set_cachesize(0, cachesize, 1)
+        # Deadlocked writers are resolved instead of waiting forever
+        self.dbenv.set_lk_detect(DB_LOCK_DEFAULT)
         self.dbenv.open(dbdir,
                         DB_CREATE |
                         DB_REGISTER |
                         DB_RECOVER |
                         DB_INIT_TXN |
                         DB_INIT_MPOOL |
-                        DB_INIT_LOCK)
+                        DB_INIT_LOCK |
+                        DB_THREAD)
 
-        register_close_handler(self.dbenv.close)
+        register_handle(self, 'env')
         
         self.db_tokens = DB(self.dbenv)
         self.db_tokens.set_pagesize(pagesize)
-        self.db_tokens.open('tokens.db', DB_RECNO, DB_CREATE, 0)
-        register_close_handler(self.db_tokens.close)
+        self.db_tokens.open('tokens.db', DB_RECNO, DB_CREATE | DB_THREAD, 0)
         
         # Registry of all group tokens. group -> tokens ids
         self.db_groups = DB(self.dbenv)
         self.db_groups.set_flags(DB_DUP)
         self.db_groups.set_pagesize(pagesize)
-        self.db_groups.open('groups.db', DB_BTREE, DB_CREATE, 0)
+        self.db_groups.open('groups.db', DB_BTREE, DB_CREATE | DB_THREAD, 0)
 
-        register_close_handler(self.db_tokens.close)
+        # Cached number of group tokens. group -> count
+        self._sizepack = struct.Struct('<I').pack
+        self._sizeunpack = struct.Struct('<I').unpack
+        self.db_groupsizes = DB(self.dbenv)
+        self.db_groupsizes.set_pagesize(pagesize)
+        self.db_groupsizes.open('groupsizes.db', DB_BTREE, DB_CREATE | DB_THREAD, 0)
         
-        # Header of metadata: key, timestamp, ttl
-        metastruct = struct.Struct('255p d d')
-        self._metapack = metastruct.pack
-        self._metaunpack = metastruct.unpack
-        self._metalen = metastruct.size
-        register_close_handler(self.db_groups.close)
-        
-        self._keypack = struct.Struct('255p').pack
+        # Header of metadata: magic, version, timestamp, ttl, key length.
+        # The key follows the header, then the payload.
+        headstruct = struct.Struct('<B B d d B')
+        self._headpack = headstruct.pack
+        self._headunpack = headstruct.unpack
+        self._headlen = headstruct.size
+        self._timepack = struct.Struct('<d').pack
+
+        # Legacy header of metadata: key, timestamp, ttl.
+        # Records in this format are upgraded when rewritten.
+        legacystruct = struct.Struct('255p d d')
+        self._legacyunpack = legacystruct.unpack
+        self._legacylen = legacystruct.size
+
+        # Time index of all tokens. expiry -> token id
+        # Big-endian doubles of positive values are ordered bytewise.
+        self._expirypack = struct.Struct('>d').pack
+        self.db_expiry = DB(self.dbenv)
+        self.db_expiry.set_flags(DB_DUP | DB_DUPSORT)
+        self.db_expiry.set_pagesize(pagesize)
+        self.db_expiry.open('expiry.db', DB_BTREE, DB_CREATE | DB_THREAD, 0)
+
+        # Empty index is built from the existing tokens
+        self.db_tokens.associate(self.db_expiry, self._expirykey, DB_CREATE)
+
+        # Signed tokens carry tid, group hash and expiry, and are verified
+        # without reading the database, see DbTokens.verify
+        self._signed = signed
+        self._claimsstruct = struct.Struct('<I d')
+        self._tidpack = struct.Struct('>I').pack
+
+        if signed:
+            # Key of signatures. b'hmackey' -> key
+            self.db_meta = DB(self.dbenv)
+            self.db_meta.open('meta.db', DB_BTREE, DB_CREATE | DB_THREAD, 0)
+
+            try:
+                self.db_meta.put(b'hmackey', urandom(32), flags=DB_NOOVERWRITE)
+            except DBKeyExistError:
+                pass
+
+            self._hmackey = self.db_meta.get(b'hmackey')
+
+            # Keys of removed and rekeyed signed tokens. tid + key -> latest expiry
+            self.db_revoked = DB(self.dbenv)
+            self.db_revoked.open('revoked.db', DB_BTREE, DB_CREATE | DB_THREAD, 0)
+
+            self._revocations = revocations
+            # Revocations made while the filter is rebuilt, see DbTokens.rebuild_revocations
+            self._revlock = threading.Lock()
+            self._revpending = None
+            self._revstats = {
+                'checks': 0,
+                'hits': 0,
+                'falsepositives': 0,
+                'rebuilds': 0,
+                'entries': 0,
+                'lastrebuild': 0.0
+            }
+            self.rebuild_revocations()
+
+        self._sweeper = None
+        self._sweepstop = threading.Event()
+        self._sweepstats = {
+            'passes': 0,
+            'tokens': 0,
+            'groups': 0,
+            'lastpass': 0.0,
+            'lastduration': 0.0
+        }
         
         self.set_keylen(keylen)
         self.set_refreshtime(refreshtime)
         self.set_maxgrouptokens(maxgrouptokens)
+        self.set_sweeplimits(sweepbatch, sweepinterval, sweeprate)
 
     def __del__(self):
         self.close()
 
+    def _metadump(self, key, timestamp, ttl):
+        return self._headpack(RECORD_MAGIC, RECORD_VERSION, timestamp, ttl, len(key)) + key
+
+    def _metaload(self, value):
+        '''Returns metadata (key, timestamp, ttl) and offset of the payload.
+        '''
+        # Legacy records start with the length of pascal string, which is < 255
+        if value[0] != RECORD_MAGIC:
+            return self._legacyunpack(value[:self._legacylen]), self._legacylen
+
+        magic, version, timestamp, ttl, keylen = self._headunpack(value[:self._headlen])
+
+        if version != RECORD_VERSION:
+            raise ValueError('Unsupported token record version %i' % version)
+
+        offset = self._headlen + keylen
+        return (value[self._headlen:offset], timestamp, ttl), offset
+
+    def _tokendump(self, tid, key, group, expiry):
+        raw = self._tokenpack(tid, key)
+
+        if self._signed:
+            raw += self._claimsstruct.pack(zlib.crc32(self._dumps(group)), expiry)
+            raw += self._sign(raw)
+
+        return hexlify(raw).decode()
+
+    def _parsetoken(self, token):
+        '''Returns tid, tkey of the token. Signatures of signed tokens are checked.
+        '''
+        raw = unhexlify(token)
+
+        if len(raw) != self._tokenlen:
+            if not self._signed or len(raw) != self._signedlen:
+                raise ValueError('Invalid token length')
+
+            if not hmac.compare_digest(self._sign(raw[:-SIGNATURE_LEN]), raw[-SIGNATURE_LEN:]):
+                raise ValueError('Invalid token signature')
+
+            raw = raw[:self._tokenlen]
+
+        return self._tokenunpack(raw)
+
+    def _sign(self, raw):
+        return hmac.new(self._hmackey, raw, hashlib.sha256).digest()[:SIGNATURE_LEN]
+
+    def _expirykey(self, tid, value):
+        (key, timestamp, ttl), offset = self._metaload(value)
+        return self._expirypack(timestamp + ttl)
+
     def create(self, group, data, ttl):
         '''Creates token.
         group:
@@ -134,7 +305,7 @@ class DbTokens:
         '''
         key = next(self._keypool)
         timestamp = time.time()
-        metadata = self._metapack(key, timestamp, ttl)
+        metadata = self._metadump(key, timestamp, ttl)
         payload = self._dumps((group, data))
         cursor = self.db_groups.cursor()
 
@@ -144,26 +315,166 @@ class DbTokens:
             if not tid:
                 raise ValueError('Token insertion failed')
 
-            cursor.put(self._dumps(group), str(tid).encode(), DB_KEYFIRST)
-
-            # If the maximum is reached, the last token id will be deleted
-            if cursor.count() > self._maxgrouptokens:
-                last_tid = int(cursor.get(DB_LAST)[1])
-                cursor.delete()
-                
-                try:
-                    self.db_tokens.delete(last_tid)
-                except DBKeyEmptyError: pass
+            self._putgroup(cursor, group, tid)
         finally:
             cursor.close()
 
-        return hexlify(self._tokenpack(tid, key)).decode(), {
+        return self._tokendump(tid, key, group, timestamp + ttl), {
             'data': data,
             'group': group,
             'ttl': ttl,
             'timestamp': timestamp
         }
 
+    def create_many(self, items):
+        '''Creates tokens for each (group, data, ttl) item.
+        All records are appended first, then the groups registry is updated with a single cursor.
+        Returns list of tuples the same as DbTokens.create, in order of items.
+        '''
+        timestamp = time.time()
+        created = []
+
+        for group, data, ttl in items:
+            key = next(self._keypool)
+            metadata = self._metadump(key, timestamp, ttl)
+            tid = self.db_tokens.append(metadata+self._dumps((group, data)))
+
+            if not tid:
+                raise ValueError('Token insertion failed')
+
+            created.append((tid, key, group, data, ttl))
+
+        cursor = self.db_groups.cursor()
+
+        try:
+            for tid, key, group, data, ttl in created:
+                self._putgroup(cursor, group, tid)
+        finally:
+            cursor.close()
+
+        return [(self._tokendump(tid, key, group, timestamp + ttl), {
+            'data': data,
+            'group': group,
+            'ttl': ttl,
+            'timestamp': timestamp
+        }) for tid, key, group, data, ttl in created]
+
+    def _putgroup(self, cursor, group, tid):
+        rgroup = self._dumps(group)
+        cursor.put(rgroup, str(tid).encode(), DB_KEYFIRST)
+
+        # If the maximum is reached, the oldest token of group will be deleted
+        if self._addgroupsize(rgroup, 1) > self._maxgrouptokens:
+            # Tokens are inserted first, so the oldest one is the last duplicate
+            if cursor.next_nodup():
+                record = cursor.prev()
+            else:
+                record = cursor.last()
+
+            cursor.delete()
+            self._addgroupsize(rgroup, -1)
+            tid = int(record[1])
+
+            if self._signed:
+                value = self.db_tokens.get(tid)
+
+                if value:
+                    self._revoke(tid, self._metaload(value)[0])
+            
+            try:
+                self.db_tokens.delete(tid)
+            except DBKeyEmptyError: pass
+
+    def _addgroupsize(self, rgroup, delta):
+        '''Adds delta to the cached number of group tokens, returns the new number.
+        Must be called after the groups registry has been changed.
+        '''
+        cursor = self.db_groupsizes.cursor()
+
+        try:
+            record = cursor.set(rgroup, flags=DB_RMW)
+
+            if record:
+                size = max(self._sizeunpack(record[1])[0] + delta, 0)
+            else:
+                # Missing counters are restored from the registry
+                size = self._countgroup(rgroup)
+
+            if size:
+                cursor.put(rgroup, self._sizepack(size), DB_CURRENT if record else DB_KEYLAST)
+            elif record:
+                cursor.delete()
+        finally:
+            cursor.close()
+
+        return size
+
+    def _countgroup(self, rgroup):
+        cursor = self.db_groups.cursor()
+
+        try:
+            return cursor.count() if cursor.set(rgroup, dlen=0, doff=0) else 0
+        finally:
+            cursor.close()
+
+    def groupsize(self, group):
+        '''Returns the number of group tokens.
+        The counters are updated apart from the groups registry, not in a transaction,
+        so after a crash they are approximate until DbTokens.repair_groupsizes.
+        '''
+        rgroup = self._dumps(group)
+        value = self.db_groupsizes.get(rgroup)
+
+        if value:
+            return self._sizeunpack(value)[0]
+        else:
+            return self._countgroup(rgroup)
+
+    def repair_groupsizes(self):
+        '''Recounts the tokens of each group in the groups registry and rewrites the counters
+        which differ, counters of groups without tokens are deleted. Intended to run offline,
+        for example after a crash. Returns the number of repaired counters.
+        '''
+        sizes = {}
+        cursor = self.db_groups.cursor(flags=DB_CURSOR_BULK)
+
+        try:
+            record = cursor.first(dlen=0, doff=0)
+
+            while record:
+                sizes[record[0]] = cursor.count()
+                record = cursor.next_nodup(dlen=0, doff=0)
+        finally:
+            cursor.close()
+
+        repaired = 0
+        cursor = self.db_groupsizes.cursor()
+
+        try:
+            record = cursor.first(DB_RMW)
+
+            while record:
+                rgroup, value = record
+                size = sizes.pop(rgroup, 0)
+
+                if not size:
+                    cursor.delete()
+                    repaired += 1
+                elif self._sizeunpack(value)[0] != size:
+                    cursor.put(rgroup, self._sizepack(size), DB_CURRENT)
+                    repaired += 1
+
+                record = cursor.next(DB_RMW)
+
+            # Groups which have lost their counters
+            for rgroup, size in sizes.items():
+                cursor.put(rgroup, self._sizepack(size), DB_KEYLAST)
+                repaired += 1
+        finally:
+            cursor.close()
+
+        return repaired
+
     def get(self, token, rawdata=None):
         '''Tries to get token data "as is", including all metadata without checks.
         Returns tid, tkey, ((key, timestamp, ttl), (group, data))
@@ -171,11 +482,11 @@ class DbTokens:
             TokenInvalidError
         '''
         try:
-            tid, tkey = self._tokenunpack(unhexlify(token))
+            tid, tkey = self._parsetoken(token)
             value = rawdata or self.db_tokens[tid]
+            metadata, offset = self._metaload(value)
             
-            return (tid, tkey, (self._metaunpack(value[:self._metalen]),
-                                self._loads(value[self._metalen:])))
+            return (tid, tkey, (metadata, self._loads(value[offset:])))
         except Exception:
             raise TokenInvalidError(token)
 
@@ -190,23 +501,14 @@ class DbTokens:
             TokenInvalidError, TokenExpiredError.
         '''
         tid, tkey, ((key, timestamp, ttl), (group, data)) = self.get(token)
-        
-        if tkey != key:
-            raise TokenInvalidError(token)
-
         timecurrent = time.time()
-        
-        if timecurrent > timestamp + ttl:
-            raise TokenExpiredError(token)
 
         # Update timestamp
-        if timecurrent - timestamp > self._refreshtime:
+        if self._verify(token, tkey, key, timestamp, ttl, timecurrent):
             cursor = self.db_tokens.cursor()
 
             try:
-                if cursor.set(tid, flags=DB_RMW, dlen=0, doff=0):
-                    metadata = self._metapack(key, timecurrent, ttl)
-                    cursor.put(0, metadata, flags=DB_CURRENT, dlen=self._metalen, doff=0)
+                self._refresh(cursor, tid, key, timecurrent, ttl)
             finally:
                 cursor.close()
 
@@ -217,11 +519,226 @@ class DbTokens:
             'timestamp': timestamp
         }
 
+    def authenticate_many(self, tokens):
+        '''Perform check of several tokens.
+        Records are read in order of token ids, and all required timestamp updates are written with a single cursor.
+        Returns list in order of tokens, where each item is either dict of token data (see DbTokens.authenticate) or instance of TokenError,
+        or None if the record of the token could not be read, for example of token id 0.
+        '''
+        results = [None] * len(tokens)
+        pending = []
+
+        for i, token in enumerate(tokens):
+            try:
+                tid, tkey = self._parsetoken(token)
+            except Exception:
+                results[i] = TokenInvalidError(token)
+            else:
+                pending.append((tid, i))
+
+        pending.sort()
+        timecurrent = time.time()
+        refresh = []
+        cursor = self.db_tokens.cursor()
+
+        try:
+            for tid, i in pending:
+                token = tokens[i]
+
+                try:
+                    record = cursor.set(tid)
+                    tid, tkey, ((key, timestamp, ttl), (group, data)) = \
+                        self.get(token, record and record[1])
+
+                    if self._verify(token, tkey, key, timestamp, ttl, timecurrent):
+                        refresh.append((tid, key, ttl))
+                except TokenError as e:
+                    results[i] = e
+                    continue
+                except DBError:
+                    continue
+
+                results[i] = {
+                    'data': data,
+                    'group': group,
+                    'ttl': ttl,
+                    'timestamp': timestamp
+                }
+
+            for tid, key, ttl in refresh:
+                self._refresh(cursor, tid, key, timecurrent, ttl)
+        finally:
+            cursor.close()
+
+        return results
+
+    def _verify(self, token, tkey, key, timestamp, ttl, timecurrent):
+        # Returns True if the timestamp should be updated
+        if tkey != key:
+            raise TokenInvalidError(token)
+
+        if timecurrent > timestamp + ttl:
+            raise TokenExpiredError(token)
+
+        return timecurrent - timestamp > self._refreshtime
+
+    def _refresh(self, cursor, tid, key, timecurrent, ttl):
+        record = cursor.set(tid, flags=DB_RMW, dlen=1, doff=0)
+
+        if not record:
+            return
+
+        if record[1][0] == RECORD_MAGIC:
+            # Only the timestamp is rewritten, it follows the magic and version bytes
+            cursor.put(0, self._timepack(timecurrent), flags=DB_CURRENT, dlen=8, doff=2)
+        else:
+            value = cursor.current(flags=DB_RMW)[1]
+            offset = self._metaload(value)[1]
+            metadata = self._metadump(key, timecurrent, ttl)
+            cursor.put(0, metadata+value[offset:], flags=DB_CURRENT)
+
+    def verify(self, token):
+        '''Checks signed token without reading the database.
+        Signature and expiry are checked against the token claims, the database is read only if the token id is found in the revocation filter.
+        Expiry of signed token is fixed at creation time and is not extended by DbTokens.authenticate.
+        If successful, returns dict of token claims:
+            tid
+            grouphash - crc32 of the serialized group
+            expiry
+        Exceptions:
+            TokenInvalidError, TokenExpiredError.
+        '''
+        if not self._signed:
+            raise RuntimeError('DbTokens is not configured for signed tokens')
+
+        try:
+            raw = unhexlify(token)
+
+            if len(raw) != self._signedlen:
+                raise ValueError('Invalid token length')
+
+            tid, tkey = self._tokenunpack(raw[:self._tokenlen])
+            grouphash, expiry = self._claimsstruct.unpack(raw[self._tokenlen:-SIGNATURE_LEN])
+        except Exception:
+            raise TokenInvalidError(token)
+
+        if not hmac.compare_digest(self._sign(raw[:-SIGNATURE_LEN]), raw[-SIGNATURE_LEN:]):
+            raise TokenInvalidError(token)
+
+        if time.time() > expiry:
+            raise TokenExpiredError(token)
+
+        stats = self._revstats
+        stats['checks'] += 1
+
+        # Revocations are per key, so the token that a rekey issued for the same tid passes
+        if self._tidpack(tid) + tkey in self._revoked:
+            stats['hits'] += 1
+            value = self.db_tokens.get(tid)
+
+            if not value or self._metaload(value)[0][0] != tkey:
+                raise TokenInvalidError(token)
+
+            stats['falsepositives'] += 1
+
+        return {
+            'tid': tid,
+            'grouphash': grouphash,
+            'expiry': expiry
+        }
+
+    def _revoke(self, tid, metadata):
+        if not self._signed:
+            return
+
+        # Signed expiry never exceeds the latest timestamp + ttl
+        key, timestamp, ttl = metadata
+        rkey = self._tidpack(tid) + key
+        self.db_revoked.put(rkey, self._timepack(timestamp + ttl))
+
+        with self._revlock:
+            self._revoked.add(rkey)
+
+            if self._revpending is not None:
+                self._revpending.append(rkey)
+
+    def rebuild_revocations(self):
+        '''Rebuilds the local revocation filter from the database.
+        Revocations of already expired tokens are dropped. Revocations made by other processes become visible after the rebuild.
+        Revocations of this process made during the scan are added to the new filter before it replaces the current one.
+        Does nothing for unsigned tokens or while another rebuild runs.
+        '''
+        if not self._signed:
+            return
+
+        with self._revlock:
+            if self._revpending is not None:
+                return
+
+            self._revpending = []
+
+        timecurrent = time.time()
+        records = []
+
+        try:
+            cursor = self.db_revoked.cursor(flags=DB_CURSOR_BULK)
+
+            try:
+                record = cursor.first(DB_RMW)
+
+                while record:
+                    if struct.unpack('<d', record[1])[0] < timecurrent:
+                        cursor.delete()
+                    else:
+                        records.append(record[0])
+
+                    record = cursor.next(DB_RMW)
+            finally:
+                cursor.close()
+        except BaseException:
+            with self._revlock:
+                self._revpending = None
+
+            raise
+
+        with self._revlock:
+            records.extend(self._revpending)
+            revoked = BloomFilter(max(self._revocations, len(records) * 2), 0.001)
+
+            for rkey in records:
+                revoked.add(rkey)
+
+            self._revoked = revoked
+            self._revpending = None
+
+        stats = self._revstats
+        stats['rebuilds'] += 1
+        stats['entries'] = len(records)
+        stats['lastrebuild'] = timecurrent
+
+    def revocationstats(self):
+        '''Returns dict of the revocation filter statistics:
+            checks - verified tokens
+            hits - tokens found in the filter
+            falsepositives - found tokens which were not revoked
+            rebuilds
+            entries - revocations at the last rebuild
+            lastrebuild - timestamp of the last rebuild
+            fprate - estimated false positive rate of the filter
+        Returns None for unsigned tokens.
+        '''
+        if not self._signed:
+            return None
+
+        stats = dict(self._revstats)
+        stats['fprate'] = self._revoked.fprate()
+        return stats
+
     def putdata(self, token, newdata):
         '''Rewrite token data.
         '''
         try:
-            tid, tkey = self._tokenunpack(unhexlify(token))
+            tid, tkey = self._parsetoken(token)
         except Exception:
             raise TokenInvalidError(token)
 
@@ -235,11 +752,11 @@ class DbTokens:
             else:
                 rawdata = record[1]
             
-            metadata = rawdata[:self._metalen]
-            group, data = self._loads(rawdata[self._metalen:])
+            metadata, offset = self._metaload(rawdata)
+            group, data = self._loads(rawdata[offset:])
                                             
             payload = self._dumps((group, newdata))
-            cursor.put(0, metadata+payload, flags=DB_CURRENT)
+            cursor.put(0, self._metadump(*metadata)+payload, flags=DB_CURRENT)
         finally:
             cursor.close()
         
@@ -249,22 +766,28 @@ class DbTokens:
         '''
         
         try:
-            tid, tkey = self._tokenunpack(unhexlify(token))
+            tid, tkey = self._parsetoken(token)
         except Exception:
             raise TokenInvalidError(token)
 
         cursor = self.db_tokens.cursor()
 
         try:
-            if not cursor.set(tid, flags=DB_RMW, dlen=0, doff=0):
+            record = cursor.set(tid, flags=DB_RMW)
+
+            if not record:
                 raise TokenNotFoundError(token)
 
+            (oldkey, timestamp, ttl), offset = self._metaload(record[1])
             key = next(self._keypool)
-            cursor.put(0, self._keypack(key), flags=DB_CURRENT, dlen=255, doff=0)
+            metadata = self._metadump(key, timestamp, ttl)
+            cursor.put(0, metadata+record[1][offset:], flags=DB_CURRENT)
+            group, data = self._loads(record[1][offset:])
+            self._revoke(tid, (oldkey, timestamp, ttl))
         finally:
             cursor.close()
             
-        return hexlify(self._tokenpack(tid, key))
+        return self._tokendump(tid, key, group, timestamp + ttl).encode()
     
     def remove(self, token):
         '''Removing token.
@@ -278,8 +801,12 @@ class DbTokens:
 
         try:
             self.db_tokens.delete(tid)
-            cursor.set_both(self._dumps(group), str(tid).encode())
-            cursor.delete()
+            self._revoke(tid, (key, timestamp, ttl))
+            rgroup = self._dumps(group)
+
+            if cursor.set_both(rgroup, str(tid).encode()):
+                cursor.delete()
+                self._addgroupsize(rgroup, -1)
         except (KeyError, DBInvalidArgError):
             pass
         finally:
@@ -289,23 +816,208 @@ class DbTokens:
         '''Remove all groups's tokens.
         '''
         group = self._dumps(group)
-        cursor = self.db_groups.cursor()
+        tids = []
+        cursor = self.db_groups.cursor(flags=DB_CURSOR_BULK)
 
         try:
             record = cursor.set(group)
 
             while record:
-                try: self.db_tokens.delete(int(record[1]))
-                except KeyError: pass
-                
+                tids.append(int(record[1]))
                 record = cursor.next(DB_NEXT_DUP)
+        finally:
+            cursor.close()
 
-            self.db_groups.delete(group)
-        except KeyError:
-            pass
+        if not tids:
+            return
+
+        # Tokens are deleted in order of ids with a single cursor,
+        # the group's duplicates and counter are deleted at once.
+        tids.sort()
+        cursor = self.db_tokens.cursor()
+
+        try:
+            for tid in tids:
+                if self._signed:
+                    record = cursor.set(tid, flags=DB_RMW)
+
+                    if record:
+                        self._revoke(tid, self._metaload(record[1])[0])
+                else:
+                    record = cursor.set(tid, flags=DB_RMW, dlen=0, doff=0)
+
+                if record:
+                    cursor.delete()
         finally:
             cursor.close()
 
+        for db in (self.db_groups, self.db_groupsizes):
+            try: db.delete(group)
+            except KeyError: pass
+
+    def migrate(self, batch=1000, compact=True):
+        '''Rewrites all records of the legacy format.
+        Intended to run offline, records are rewritten in batches of the given size.
+        If compact is set, the free pages are returned to the filesystem.
+        Returns the number of rewritten records.
+        '''
+        migrated = 0
+        tid = 0
+
+        while True:
+            count = 0
+            cursor = self.db_tokens.cursor()
+
+            try:
+                # Continue after the last record of the previous batch
+                if tid:
+                    record = cursor.set(tid) and cursor.next(DB_RMW)
+                else:
+                    record = cursor.first(DB_RMW)
+
+                while record and count < batch:
+                    tid, value = record
+
+                    if value[0] != RECORD_MAGIC:
+                        metadata, offset = self._metaload(value)
+                        cursor.put(0, self._metadump(*metadata)+value[offset:], flags=DB_CURRENT)
+                        migrated += 1
+
+                    count += 1
+                    record = cursor.next(DB_RMW)
+            finally:
+                cursor.close()
+
+            if count < batch:
+                break
+
+        if compact:
+            self.db_tokens.compact(flags=DB_FREE_SPACE)
+
+        return migrated
+
+    def sweep(self, limit=None):
+        '''Removes a bounded batch of expired tokens and their group records.
+        Returns the number of removed tokens.
+        '''
+        limit = limit or self._sweepbatch
+        started = time.time()
+        bound = self._expirypack(started)
+        expired = []
+        cursor = self.db_expiry.cursor()
+
+        # Collect the batch first, so the index cursor does not hold
+        # its locks while the primary records are deleted.
+        try:
+            record = cursor.pget(DB_FIRST)
+
+            while record and len(expired) < limit and record[0] < bound:
+                expired.append(record[1:])
+                record = cursor.pget(DB_NEXT)
+        finally:
+            cursor.close()
+
+        tokens = groups = 0
+        sizes = {}
+        cursor = self.db_groups.cursor()
+
+        try:
+            for tid, value in expired:
+                # Token could be refreshed since it was collected
+                try:
+                    value = self.db_tokens.get(tid)
+                except DBKeyEmptyError:
+                    continue
+
+                if not value or self._expirykey(tid, value) >= bound:
+                    continue
+
+                metadata, offset = self._metaload(value)
+                group, data = self._loads(value[offset:])
+
+                try:
+                    self.db_tokens.delete(tid)
+                    tokens += 1
+                except (KeyError, DBKeyEmptyError):
+                    continue
+
+                rgroup = self._dumps(group)
+
+                if cursor.set_both(rgroup, str(tid).encode()):
+                    cursor.delete()
+                    sizes[rgroup] = sizes.get(rgroup, 0) - 1
+                    groups += 1
+        finally:
+            cursor.close()
+
+        for rgroup, delta in sizes.items():
+            self._addgroupsize(rgroup, delta)
+
+        stats = self._sweepstats
+        stats['passes'] += 1
+        stats['tokens'] += tokens
+        stats['groups'] += groups
+        stats['lastpass'] = started
+        stats['lastduration'] = time.time() - started
+
+        return tokens
+
+    def sweepstats(self):
+        '''Returns dict of the expiry sweeper statistics:
+            passes
+            tokens - total removed tokens
+            groups - total removed group records
+            lastpass - timestamp of the last pass
+            lastduration - duration of the last pass
+        '''
+        return dict(self._sweepstats)
+
+    def start_sweeper(self):
+        '''Starts the background thread that removes expired tokens.
+        '''
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+
+        self._sweepstop.clear()
+        self._sweeper = threading.Thread(target=self._sweeploop,
+                                         name='DbTokens-sweeper',
+                                         daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        '''Stops the background sweeper and waits for the current pass.
+        '''
+        if self._sweeper is None:
+            return
+
+        self._sweepstop.set()
+        self._sweeper.join()
+        self._sweeper = None
+
+    def _sweeploop(self):
+        while not self._sweepstop.is_set():
+            try:
+                removed = self.sweep()
+            except DBError:
+                warnings.warn('DbTokens sweep failed', RuntimeWarning)
+                removed = 0
+
+            if self._signed and time.time() - self._revstats['lastrebuild'] > self._sweepinterval:
+                try:
+                    self.rebuild_revocations()
+                except DBError:
+                    warnings.warn('DbTokens revocations rebuild failed', RuntimeWarning)
+
+            # A full batch means there is more work, go on at the limited rate
+            if removed >= self._sweepbatch and self._sweeprate:
+                delay = removed / self._sweeprate
+            elif removed >= self._sweepbatch:
+                delay = 0
+            else:
+                delay = self._sweepinterval
+
+            self._sweepstop.wait(delay)
+
     def set_keylen(self, keylen, pool=500):
         '''Sets token key length.
         All previous tokens of a different length will be invalid.
@@ -318,8 +1030,10 @@ class DbTokens:
         self._tokenpack = tokenstruct.pack
         self._tokenunpack = tokenstruct.unpack
         self._tokenlen = tokenstruct.size
+        self._signedlen = self._tokenlen + self._claimsstruct.size + SIGNATURE_LEN
         
-        self._keypool = urandompool(keylen, pool)
+        # Replaced as a whole, so concurrent callers keep using the previous source
+        self._keypool = KeySource(keylen, pool)
 
     def set_refreshtime(self, timeout):
         '''Sets the timestamp resolution.
@@ -333,17 +1047,232 @@ class DbTokens:
         '''
         self._maxgrouptokens = tokens
 
+    def set_sweeplimits(self, batch, interval, rate=None):
+        '''Sets the expiry sweeper limits.
+        batch:
+            Maximum tokens removed in one pass.
+        interval:
+            Seconds between passes when there are no more expired tokens.
+        rate:
+            Maximum tokens removed per second while catching up, None for no limit.
+        '''
+        self._sweepbatch = batch
+        self._sweepinterval = interval
+        self._sweeprate = rate
+
     def sync(self):
         '''Flush cached pages to disk. May be called periodically.
         '''
         self.db_tokens.sync()
         self.db_groups.sync()
+        self.db_groupsizes.sync()
+
+        if self._signed:
+            self.db_revoked.sync()
+        self.db_expiry.sync()
 
     def close(self):
         '''Closes the database of tokens.
         Important: this method should be called ALWAYS before the process is terminating, otherwise some of the cached data may not be saved.
         '''
+        self.stop_sweeper()
+        unregister_handle(self, 'env')
+
+        # The secondary index first, the environment last
+        dbs = [self.db_expiry, self.db_tokens, self.db_groups, self.db_groupsizes]
+
+        if self._signed:
+            dbs += [self.db_meta, self.db_revoked]
+
+        for db in dbs:
+            db.close()
+
         self.dbenv.close()
 
 
 
+class DbShardedTokens:
+    '''Token store spread over several DbTokens environments.
+    The shard of a token is chosen by hash of its group, so all tokens of a group live in one shard. The shard id is encoded in the token as two leading hex digits.
+    The number of shards must not change for an existing store.
+    '''
+    def __init__(self, dbdir, shards=4, dumps=marshal.dumps, **kwargs):
+        if not 0 < shards <= 256:
+            raise ValueError('shards must be in range 1..256')
+
+        self._dumps = dumps
+        self.shards = []
+
+        for i in range(shards):
+            shardir = os.path.join(dbdir, 'shard%03i' % i)
+            os.makedirs(shardir, exist_ok=True)
+            self.shards.append(DbTokens(shardir, dumps=dumps, **kwargs))
+
+    def shardof(self, group):
+        '''Returns shard index of the group.
+        '''
+        return zlib.crc32(self._dumps(group)) % len(self.shards)
+
+    def _split(self, token):
+        try:
+            prefix = token[:2]
+
+            if isinstance(prefix, bytes):
+                prefix = prefix.decode('ascii')
+
+            # int() also takes signs and spaces, "-1" would index the last shard
+            if len(prefix) != 2 or not HEXDIGITS.issuperset(prefix):
+                raise ValueError('Invalid shard prefix')
+
+            index = int(prefix, 16)
+            return index, self.shards[index], token[2:]
+        except (ValueError, TypeError, IndexError):
+            raise TokenInvalidError(token)
+
+    def create(self, group, data, ttl):
+        '''Creates token in the shard of group, see DbTokens.create.
+        '''
+        index = self.shardof(group)
+        token, info = self.shards[index].create(group, data, ttl)
+        return '%02x%s' % (index, token), info
+
+    def create_many(self, items):
+        '''Creates tokens grouped by shard, see DbTokens.create_many.
+        '''
+        items = list(items)
+        results = [None] * len(items)
+        batches = {}
+
+        for i, item in enumerate(items):
+            batches.setdefault(self.shardof(item[0]), []).append(i)
+
+        for index, positions in batches.items():
+            created = self.shards[index].create_many([items[i] for i in positions])
+
+            for i, (token, info) in zip(positions, created):
+                results[i] = ('%02x%s' % (index, token), info)
+
+        return results
+
+    def get(self, token, rawdata=None):
+        index, shard, token = self._split(token)
+        return shard.get(token, rawdata)
+
+    def authenticate(self, token):
+        index, shard, token = self._split(token)
+        return shard.authenticate(token)
+
+    def authenticate_many(self, tokens):
+        '''Checks tokens grouped by shard, see DbTokens.authenticate_many.
+        '''
+        results = [None] * len(tokens)
+        batches = {}
+
+        for i, token in enumerate(tokens):
+            try:
+                index, shard, token = self._split(token)
+            except TokenInvalidError as e:
+                results[i] = e
+            else:
+                batches.setdefault(index, []).append((i, token))
+
+        for index, batch in batches.items():
+            checked = self.shards[index].authenticate_many([t for i, t in batch])
+
+            for (i, token), result in zip(batch, checked):
+                results[i] = result
+
+        return results
+
+    def verify(self, token):
+        index, shard, token = self._split(token)
+        return shard.verify(token)
+
+    def rebuild_revocations(self):
+        for shard in self.shards:
+            shard.rebuild_revocations()
+
+    def repair_groupsizes(self):
+        return sum(shard.repair_groupsizes() for shard in self.shards)
+
+    def putdata(self, token, newdata):
+        index, shard, token = self._split(token)
+        return shard.putdata(token, newdata)
+
+    def rekey(self, token):
+        index, shard, token = self._split(token)
+        return ('%02x' % index).encode() + shard.rekey(token)
+
+    def remove(self, token):
+        index, shard, token = self._split(token)
+        return shard.remove(token)
+
+    def removegroup(self, group):
+        return self.shards[self.shardof(group)].removegroup(group)
+
+    def sweep(self, limit=None):
+        return sum(shard.sweep(limit) for shard in self.shards)
+
+    def sweepstats(self):
+        '''Returns sweeper statistics summed over the shards.
+        '''
+        stats = {}
+
+        for shard in self.shards:
+            for k, v in shard.sweepstats().items():
+                if k.startswith('last'):
+                    stats[k] = max(stats.get(k, 0), v)
+                else:
+                    stats[k] = stats.get(k, 0) + v
+
+        return stats
+
+    def start_sweeper(self):
+        for shard in self.shards:
+            shard.start_sweeper()
+
+    def stop_sweeper(self):
+        for shard in self.shards:
+            shard.stop_sweeper()
+
+    def set_keylen(self, keylen, pool=500):
+        for shard in self.shards:
+            shard.set_keylen(keylen, pool)
+
+    def set_refreshtime(self, timeout):
+        for shard in self.shards:
+            shard.set_refreshtime(timeout)
+
+    def set_maxgrouptokens(self, tokens):
+        for shard in self.shards:
+            shard.set_maxgrouptokens(tokens)
+
+    def set_sweeplimits(self, batch, interval, rate=None):
+        for shard in self.shards:
+            shard.set_sweeplimits(batch, interval, rate)
+
+    def sync(self):
+        for shard in self.shards:
+            shard.sync()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 2:
+        print('Usage: python -m bdbo.tokens DBDIR', file=sys.stderr)
+        print('Upgrades the token records to the compact format.', file=sys.stderr)
+        sys.exit(2)
+
+    tokens = DbTokens(sys.argv[1])
+
+    try:
+        pages = tokens.db_tokens.stat()['leaf_pg']
+        print('Records migrated:', tokens.migrate())
+        print('Leaf pages: %i -> %i' % (pages, tokens.db_tokens.stat()['leaf_pg']))
+    finally:
+        tokens.close()
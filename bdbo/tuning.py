@@ -0,0 +1,197 @@
+import json
+import time
+import threading
+import warnings
+
+from bsddb3.db import *
+
+__all__ = [
+    'DbCacheTuner',
+    'apply_recommendations'
+]
+
+MAX_PAGESIZE = 65536
+MIN_PAGESIZE = 512
+
+
+class DbCacheTuner:
+    '''Adjusts the cache of an open DbEnv from the memp_stat samples.
+    The cache grows while the hit rate is below the target and pages are evicted, up to the memory budget (which should not exceed DbEnv.set_cache_max).
+    Dirty pages are trickled when they exceed the given fraction of the cache.
+    '''
+    def __init__(self,
+                 dbenv,
+                 budget,
+                 interval=10,
+                 growth=1.5,
+                 hitrate=0.95,
+                 dirty=0.2,
+                 trickle=20):
+
+        self.dbenv = dbenv
+        self.budget = budget
+        self.interval = interval
+        self.growth = growth
+        self.hitrate = hitrate
+        self.dirty = dirty
+        self.trickle = trickle
+
+        self.stats = {
+            'samples': 0,
+            'grows': 0,
+            'trickles': 0,
+            'trickled_pages': 0
+        }
+        self.last = None
+
+        self._previous = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def cachesize(self):
+        gbytes, nbytes, ncache = self.dbenv.get_cachesize()
+        return gbytes * 1024**3 + nbytes
+
+    def sample(self):
+        '''Returns dict of the cache rates since the previous sample:
+            hitrate
+            evictions - evicted pages per second
+            dirty - fraction of dirty pages
+            cachesize
+        '''
+        timestamp = time.time()
+        gsp = self.dbenv.memp_stat()[0]
+        hits, misses = gsp['cache_hit'], gsp['cache_miss']
+        evictions = gsp.get('ro_evict', 0) + gsp.get('rw_evict', 0)
+        previous = self._previous
+        self._previous = (timestamp, hits, misses, evictions)
+
+        if previous is None:
+            hits_delta, misses_delta, evict_delta, elapsed = hits, misses, evictions, 0
+        else:
+            hits_delta = hits - previous[1]
+            misses_delta = misses - previous[2]
+            evict_delta = evictions - previous[3]
+            elapsed = timestamp - previous[0]
+
+        pages = gsp.get('pages', 0)
+
+        self.stats['samples'] += 1
+        self.last = {
+            'timestamp': timestamp,
+            'hitrate': hits_delta / ((hits_delta + misses_delta) or 1),
+            'evictions': evict_delta / elapsed if elapsed else 0.0,
+            'dirty': gsp.get('page_dirty', 0) / (pages or 1),
+            'cachesize': self.cachesize()
+        }
+        return self.last
+
+    def tune(self):
+        '''Takes a sample and grows the cache or trickles dirty pages if required.
+        Returns the sample.
+        '''
+        sample = self.sample()
+
+        if sample['dirty'] > self.dirty:
+            self.stats['trickles'] += 1
+            self.stats['trickled_pages'] += self.dbenv.memp_trickle(self.trickle)
+
+        size = sample['cachesize']
+
+        if sample['hitrate'] < self.hitrate and sample['evictions'] and size < self.budget:
+            ncache = self.dbenv.get_cachesize()[2]
+            size = min(int(size * self.growth), self.budget)
+            self.dbenv.set_cachesize(size // 1024**3, size % 1024**3, ncache)
+            self.stats['grows'] += 1
+
+        return sample
+
+    def start(self):
+        '''Starts the background tuning thread.
+        '''
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop,
+                                        name='DbCacheTuner',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.tune()
+            except DBError:
+                warnings.warn('DbCacheTuner sample failed', RuntimeWarning)
+
+    def recommend(self, dbs=()):
+        '''Returns recommended static settings:
+            cachesize - the current cache size
+            pagesize - dict of (file name, database name) -> page size, from the fill factors of the given Db objects
+        '''
+        pagesizes = {}
+
+        for db in dbs:
+            pagesizes[tuple(db.get_dbname())] = recommend_pagesize(db.stat())
+
+        return {
+            'cachesize': self.cachesize(),
+            'pagesize': pagesizes
+        }
+
+    def save(self, path, dbs=()):
+        '''Writes recommended settings to the JSON file, see apply_recommendations.
+        '''
+        settings = self.recommend(dbs)
+        # JSON objects have string keys, page sizes are kept as [file name, database name, page size]
+        settings['pagesize'] = [[filename, dbname, pagesize] for (filename, dbname), pagesize
+                                in sorted(settings['pagesize'].items(), key=lambda item: (item[0][0], item[0][1] or ''))]
+
+        with open(path, 'w') as f:
+            json.dump(settings, f, indent=2, sort_keys=True)
+
+
+def recommend_pagesize(stat):
+    '''Returns page size for the database from its stat() dict.
+    '''
+    pagesize = stat.get('pagesize', 4096)
+    leaf = stat.get('leaf_pg', 0)
+
+    # Overflow pages and deep trees want larger pages
+    if stat.get('over_pg', 0) or stat.get('levels', 0) > 3:
+        return min(pagesize * 2, MAX_PAGESIZE)
+
+    if leaf:
+        fill = 1 - stat.get('leaf_pgfree', 0) / (leaf * pagesize)
+
+        if fill < 0.5:
+            return max(pagesize // 2, MIN_PAGESIZE)
+
+    return pagesize
+
+
+def apply_recommendations(dbenv, path):
+    '''Sets the recommended cache size of DbEnv before it is opened.
+    Returns dict of (file name, database name) -> page size, to be set by Db.set_pagesize for newly created databases.
+    '''
+    try:
+        with open(path) as f:
+            settings = json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+    size = settings.get('cachesize')
+
+    if size:
+        dbenv.set_cachesize(size // 1024**3, size % 1024**3, 1)
+
+    return {(filename, dbname): pagesize for filename, dbname, pagesize in settings.get('pagesize', [])}
@@ -1,3 +1,7 @@
+import os
+import math
+import struct
+
 from hashlib import sha1
 
 try:
@@ -15,6 +19,113 @@ literal_types = frozenset([
     type(None)
 ])
 
+try:
+    from os import register_at_fork
+except ImportError:
+    # Python < 3.7, the pid identifies the process
+    forkgeneration = os.getpid
+else:
+    _forkgeneration = [0]
+
+    def forkgeneration():
+        '''Returns a value that changes in a child process after fork.
+        '''
+        return _forkgeneration[0]
+
+    def _afterfork():
+        _forkgeneration[0] += 1
+
+    register_at_fork(after_in_child=_afterfork)
+
+
+class BloomFilter:
+    '''Bloom filter over bytes keys.
+    Sized for the expected number of keys (capacity) and the false positive rate at that number.
+    '''
+    _header = struct.Struct('<4s Q B Q')
+    _hashes = struct.Struct('<QQ').unpack_from
+
+    def __init__(self, capacity, fprate=0.01, nbits=None, nhashes=None):
+        capacity = max(capacity, 1)
+
+        if nbits is None or nhashes is None:
+            nbits, nhashes = self.parameters(capacity, fprate)
+
+        self.capacity = capacity
+        self.nbits = nbits
+        self.nhashes = nhashes
+        self.count = 0
+        self.bits = bytearray((nbits + 7) // 8)
+
+    @staticmethod
+    def parameters(capacity, fprate):
+        '''Returns (nbits, nhashes) of the filter for capacity keys at the false positive rate.
+        '''
+        capacity = max(capacity, 1)
+        nbits = int(math.ceil(-capacity * math.log(fprate) / math.log(2) ** 2))
+        return nbits, max(int(round(nbits / capacity * math.log(2))), 1)
+
+    def _positions(self, key):
+        # Double hashing, positions are h1 + i * h2
+        h1, h2 = self._hashes(sha1(key).digest())
+        nbits = self.nbits
+        return [(h1 + i * h2) % nbits for i in range(self.nhashes)]
+
+    def add(self, key):
+        '''Adds the key, returns False if all its bits were set already.
+        Only such new keys are counted, so rewrites of a key do not fill the filter.
+        '''
+        bits = self.bits
+        added = False
+
+        for pos in self._positions(key):
+            mask = 1 << (pos & 7)
+
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                added = True
+
+        if added:
+            self.count += 1
+
+        return added
+
+    def __contains__(self, key):
+        bits = self.bits
+
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+
+        return True
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+    def fprate(self):
+        '''Returns the estimated false positive rate for the added keys.
+        '''
+        return (1 - math.exp(-self.nhashes * self.count / self.nbits)) ** self.nhashes
+
+    def dumps(self):
+        return self._header.pack(b'BLM1', self.nbits, self.nhashes, self.count) + bytes(self.bits)
+
+    @classmethod
+    def loads(cls, data, capacity=None):
+        magic, nbits, nhashes, count = cls._header.unpack_from(data)
+
+        if magic != b'BLM1':
+            raise ValueError('Not a bloom filter')
+
+        if len(data) - cls._header.size != (nbits + 7) // 8:
+            raise ValueError('Truncated bloom filter')
+
+        bloom = cls(capacity or count, nbits=nbits, nhashes=nhashes)
+        bloom.bits = bytearray(data[cls._header.size:])
+        bloom.count = count
+        return bloom
+
 
 def function_digest(f):
     code = f.__code__
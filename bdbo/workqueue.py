@@ -0,0 +1,290 @@
+import json
+import time
+import struct
+import warnings
+import multiprocessing
+
+from collections import namedtuple
+
+from bsddb3.db import *
+from .db import DbEnv, Db
+
+__all__ = [
+    'DbWorkQueue',
+    'Job',
+    'start_workers'
+]
+
+# Queue record: delivery attempts, then the payload padded with spaces
+ATTEMPTS = struct.Struct('<H')
+
+# Key of the in-flight jobs: lease deadline and job id, ordered by deadline
+LEASE = struct.Struct('>d Q')
+
+WORKER_ENV_FLAGS = DB_CREATE | DB_INIT_MPOOL | DB_INIT_LOCK | DB_INIT_LOG | DB_INIT_TXN | DB_THREAD
+
+Job = namedtuple('Job', ['id', 'data', 'attempts', 'lease'])
+
+
+def _attempts(txn):
+    # Child transactions are not retried, the deadlock is raised to the parent
+    return None if txn is None else 1
+
+
+class DbWorkQueue:
+    '''Persistent job queue over DB_QUEUE with leases of the dequeued jobs.
+    Jobs are serialized by dumps and stored in fixed-length records of recordsize bytes
+    padded with spaces, so loads must ignore trailing whitespace (as json.loads does).
+
+    A dequeued job is moved in the same transaction to the in-flight database with the
+    lease deadline; DbWorkQueue.ack deletes it, and DbWorkQueue.requeue_expired puts the
+    jobs of expired leases back to the queue. The environment must be transactional.
+    '''
+    def __init__(self, dbenv, name, recordsize=256, timeout=30, extentsize=0,
+                 dumps=json.dumps, loads=json.loads):
+        self.dbenv = dbenv
+        self.timeout = timeout
+        self._dumps = dumps
+        self._loads = loads
+        self._maxpayload = recordsize - ATTEMPTS.size
+
+        self.db_queue = Db(dbenv)
+        self.db_queue.set_re_len(recordsize)
+        self.db_queue.set_re_pad(ord(' '))
+
+        if extentsize:
+            self.db_queue.set_q_extentsize(extentsize)
+
+        self.db_queue.open(name + '.queue', None, DB_QUEUE, DB_CREATE | DB_AUTO_COMMIT | DB_THREAD)
+
+        # Jobs being processed. (deadline, job id) -> queue record
+        self.db_inflight = Db(dbenv)
+        self.db_inflight.open(name + '.inflight', None, DB_BTREE, DB_CREATE | DB_AUTO_COMMIT | DB_THREAD)
+
+        self._started = time.time()
+        self._stats = {
+            'enqueued': 0,
+            'dequeued': 0,
+            'acked': 0,
+            'released': 0,
+            'requeued': 0
+        }
+
+    def _record(self, data, attempts=0):
+        payload = self._dumps(data)
+
+        if isinstance(payload, str):
+            payload = payload.encode()
+
+        if len(payload) > self._maxpayload:
+            raise ValueError('Job of %i bytes exceeds the record size' % len(payload))
+
+        return ATTEMPTS.pack(attempts) + payload
+
+    def enqueue(self, jobs, txn=None):
+        '''Appends the jobs in one transaction and returns list of their ids.
+        '''
+        records = [self._record(data) for data in jobs]
+        ids = self.dbenv.txn_run(self._append, records, parent=txn,
+                                 attempts=_attempts(txn), name='workqueue_enqueue')
+        self._stats['enqueued'] += len(ids)
+        return ids
+
+    def _append(self, txn, records):
+        append = self.db_queue._cobj.append
+        return [append(record, txn) for record in records]
+
+    def dequeue(self, count=1, timeout=None, txn=None):
+        '''Takes up to count jobs in one transaction and returns list of Job leased for timeout seconds.
+        Returns an empty list if the queue is empty.
+        '''
+        deadline = time.time() + (self.timeout if timeout is None else timeout)
+        jobs = self.dbenv.txn_run(self._consume, count, deadline, parent=txn,
+                                  attempts=_attempts(txn), name='workqueue_dequeue')
+        self._stats['dequeued'] += len(jobs)
+        return jobs
+
+    def _consume(self, txn, count, deadline):
+        consume = self.db_queue._cobj.consume
+        lease = self.db_inflight._cobj.put
+        jobs = []
+
+        for i in range(count):
+            try:
+                record = consume(txn)
+            except DBNotFoundError:
+                record = None
+
+            if not record:
+                break
+
+            jid, rdata = record
+            key = LEASE.pack(deadline, jid)
+            lease(key, rdata, txn)
+            attempts, = ATTEMPTS.unpack_from(rdata)
+            jobs.append(Job(jid, self._loads(rdata[ATTEMPTS.size:]), attempts, key))
+
+        return jobs
+
+    def ack(self, jobs, txn=None):
+        '''Completes the jobs in one transaction, returns number of jobs whose leases were still held.
+        '''
+        acked = self.dbenv.txn_run(self._unlease, jobs, False, parent=txn,
+                                   attempts=_attempts(txn), name='workqueue_ack')
+        self._stats['acked'] += acked
+        return acked
+
+    def release(self, jobs, txn=None):
+        '''Puts the jobs back to the queue before their leases expire, e.g. when processing failed.
+        '''
+        released = self.dbenv.txn_run(self._unlease, jobs, True, parent=txn,
+                                      attempts=_attempts(txn), name='workqueue_release')
+        self._stats['released'] += released
+        return released
+
+    def _unlease(self, txn, jobs, requeue):
+        inflight = self.db_inflight._cobj
+        done = 0
+
+        for job in jobs:
+            rdata = inflight.get(job.lease, txn=txn, flags=DB_RMW)
+
+            if rdata is None:
+                # The lease expired and the job was requeued
+                continue
+
+            inflight.delete(job.lease, txn)
+
+            if requeue:
+                self.db_queue._cobj.append(ATTEMPTS.pack(min(job.attempts + 1, 0xFFFF)) + rdata[ATTEMPTS.size:], txn)
+
+            done += 1
+
+        return done
+
+    def requeue_expired(self, limit=1000, txn=None):
+        '''Puts up to limit jobs of the expired leases back to the queue, returns their number.
+        '''
+        requeued = self.dbenv.txn_run(self._requeue, limit, time.time(), parent=txn,
+                                      attempts=_attempts(txn), name='workqueue_requeue')
+        self._stats['requeued'] += requeued
+        return requeued
+
+    def _requeue(self, txn, limit, now):
+        append = self.db_queue._cobj.append
+        cursor = self.db_inflight._cobj.cursor(txn)
+        requeued = 0
+
+        try:
+            record = cursor.first(flags=DB_RMW)
+
+            while record and requeued < limit:
+                key, rdata = record
+                deadline, jid = LEASE.unpack(key)
+
+                if deadline > now:
+                    break
+
+                attempts, = ATTEMPTS.unpack_from(rdata)
+                append(ATTEMPTS.pack(min(attempts + 1, 0xFFFF)) + rdata[ATTEMPTS.size:], txn)
+                cursor.delete()
+                requeued += 1
+                record = cursor.next(flags=DB_RMW)
+        finally:
+            cursor.close()
+
+        return requeued
+
+    def serve(self, handler, batch=10, idle=0.05, stop=None):
+        '''Processes jobs by handler(data) until the stop event is set: a job is acked when the
+        handler returns and released when it raises. Expired leases are requeued every lease
+        timeout, whether the queue is empty or not, so they are delivered again under load.
+        '''
+        # Leases left by stopped consumers are requeued at start
+        requeued = 0.0
+
+        while stop is None or not stop.is_set():
+            if time.time() - requeued >= self.timeout:
+                self.requeue_expired()
+                requeued = time.time()
+
+            jobs = self.dequeue(batch)
+
+            if not jobs:
+                time.sleep(idle)
+                continue
+
+            done, failed = [], []
+
+            for job in jobs:
+                try:
+                    handler(job.data)
+                except Exception:
+                    warnings.warn('Job %i failed' % job.id, RuntimeWarning)
+                    failed.append(job)
+                else:
+                    done.append(job)
+
+            if done:
+                self.ack(done)
+
+            if failed:
+                self.release(failed)
+
+    def depth(self):
+        '''Returns the approximate number of queued jobs.
+        '''
+        stat = self.db_queue.stat(DB_FAST_STAT)
+        return max(stat['cur_recno'] - stat['first_recno'], 0)
+
+    def stats(self):
+        '''Returns counters and rates per second of this handle since it was opened,
+        the approximate queue depth and the number of in-flight jobs of all processes,
+        counted by a walk of the in-flight database.
+        '''
+        elapsed = (time.time() - self._started) or 1e-9
+        stats = dict(self._stats)
+
+        for name in ('enqueued', 'dequeued', 'acked'):
+            stats[name + '_rate'] = stats[name] / elapsed
+
+        stats['depth'] = self.depth()
+        # Fast statistics of a BTREE without DB_RECNUM do not count the keys
+        stats['inflight'] = self.db_inflight.stat()['nkeys']
+        return stats
+
+    def close(self):
+        self.db_inflight.close()
+        self.db_queue.close()
+
+
+def _worker(home, name, handler, batch, stop, options):
+    dbenv = DbEnv()
+    dbenv.open(home, WORKER_ENV_FLAGS)
+
+    try:
+        queue = DbWorkQueue(dbenv, name, **options)
+
+        try:
+            queue.serve(handler, batch, stop=stop)
+        finally:
+            queue.close()
+    finally:
+        dbenv.close()
+
+
+def start_workers(home, name, handler, processes=4, batch=10, **options):
+    '''Starts consumer processes serving the queue of the environment in home with handler,
+    which must be picklable. Returns (processes, stop event); set the event and join the
+    processes to stop them. Options are passed to DbWorkQueue.
+    '''
+    stop = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=_worker,
+                                       args=(home, name, handler, batch, stop, options),
+                                       daemon=True)
+               for i in range(processes)]
+
+    for w in workers:
+        w.start()
+
+    return workers, stop
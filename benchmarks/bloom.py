@@ -0,0 +1,93 @@
+'''Measures Db.get and Db.exists latency for missing keys with and without
+the Bloom filter of keys, and the false positive rate of filter sizes.
+
+    python benchmarks/bloom.py --keys 200000 --fprates 0.1 0.01 0.001
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bdbo.db import *
+
+
+def populate(db, count):
+    for i in range(count):
+        db.put(['key', i], {'n': i})
+
+
+def miss_latency(db, count, lookups):
+    # Keys of the same shape, outside of the populated range
+    keys = [['key', count + i] for i in range(lookups)]
+    result = {}
+
+    for name, method in (('get', db.get), ('exists', db.exists)):
+        started = time.perf_counter()
+
+        for key in keys:
+            method(key)
+
+        result[name + '_miss_usec'] = (time.perf_counter() - started) / lookups * 1e6
+
+    return result
+
+
+def run(count, lookups, fprates, cachesize):
+    results = []
+
+    with tempfile.TemporaryDirectory() as home:
+        dbenv = DbEnv()
+        dbenv.set_cachesize(0, cachesize, 1)
+        dbenv.open(home, DB_CREATE | DB_INIT_MPOOL)
+
+        for fprate in [None] + fprates:
+            db = Db(dbenv)
+
+            if fprate:
+                db.set_bloom(count, fprate)
+
+            db.open('bench.db', None, DB_BTREE, DB_CREATE)
+
+            if not fprate:
+                populate(db, count)
+
+            result = {'fprate': fprate}
+            result.update(miss_latency(db, count, lookups))
+
+            if fprate:
+                stats = db.bloomstats()
+                result['measured_fprate'] = stats['falsepositives'] / stats['checks']
+                result['estimated_fprate'] = stats['fprate']
+                result['filter_bytes'] = len(db._bloom.bits)
+
+            results.append(result)
+            db.close()
+
+            # The next row builds its own filter instead of loading the saved one
+            path = os.path.join(home, 'bench.db.bloom')
+
+            if os.path.exists(path):
+                os.remove(path)
+
+        dbenv.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--keys', type=int, default=200000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--fprates', type=float, nargs='+', default=[0.1, 0.01, 0.001])
+    parser.add_argument('--cachesize', type=int, default=4*1024*1024)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.keys, args.lookups, args.fprates, args.cachesize), indent=2))
+
+
+if __name__ == '__main__':
+    main()
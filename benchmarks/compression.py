@@ -0,0 +1,115 @@
+'''Measures database size, cache hit rate of random reads and Db.get and
+Db.put CPU cost with and without value compression (Db.set_compression).
+
+    python benchmarks/compression.py --records 100000 --cachesize 8388608
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bdbo.db import *
+
+import datasets
+
+
+def open_env(home, cachesize):
+    dbenv = DbEnv(registry=True)
+    dbenv.set_cachesize(0, cachesize, 1)
+    dbenv.open(home, DB_CREATE | DB_INIT_MPOOL)
+    return dbenv
+
+
+def run(records, valuesize, lookups, cachesize, dictsize, threshold):
+    results = []
+
+    for compress in (False, True):
+        with tempfile.TemporaryDirectory() as home:
+            dbenv = open_env(home, cachesize)
+            db = Db(dbenv)
+            db.open('bench.db', None, DB_BTREE, DB_CREATE)
+            rng = random.Random(0)
+            result = {'compression': compress}
+
+            if compress:
+                # Dictionary is trained on the first tenth of the records
+                compressor = db.set_compression(threshold, dictsize=dictsize)
+
+                for n in range(records // 10):
+                    db.put(datasets.key(n), datasets.value(valuesize, n, rng))
+
+                started = time.perf_counter()
+                compressor.train()
+                result['train_sec'] = time.perf_counter() - started
+                first = records // 10
+            else:
+                first = 0
+
+            values = [datasets.value(valuesize, n, rng) for n in range(first, records)]
+            started = time.process_time()
+
+            for n, value in zip(range(first, records), values):
+                db.put(datasets.key(n), value)
+
+            result['put_cpu_usec'] = (time.process_time() - started) / len(values) * 1e6
+
+            if compress:
+                result['compressor'] = compressor.stats()
+
+            db.sync()
+            result['db_bytes'] = os.path.getsize(os.path.join(home, 'bench.db'))
+            result['leaf_pages'] = db.stat()['leaf_pg']
+
+            db.close()
+            dbenv.close()
+
+            # Random reads with the cold cache, otherwise the pages survive in the region files of home
+            DbEnv().remove(home)
+            dbenv = open_env(home, cachesize)
+            db = Db(dbenv)
+            db.open('bench.db', None, DB_BTREE, 0)
+
+            if compress:
+                db.set_compression(threshold, dictsize=dictsize)
+
+            pick = datasets.picker(records, 'uniform', 1)
+            before = dbenv.memp_stat()[0]
+            started = time.process_time()
+
+            for i in range(lookups):
+                db.get(datasets.key(pick()))
+
+            result['get_cpu_usec'] = (time.process_time() - started) / lookups * 1e6
+            after = dbenv.memp_stat()[0]
+            hits = after['cache_hit'] - before['cache_hit']
+            misses = after['cache_miss'] - before['cache_miss']
+            result['hitrate'] = hits / ((hits + misses) or 1)
+
+            db.close()
+            dbenv.close()
+            results.append(result)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--valuesize', type=int, default=200)
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--cachesize', type=int, default=8*1024*1024)
+    parser.add_argument('--dictsize', type=int, default=4096)
+    parser.add_argument('--threshold', type=int, default=64)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.records, args.valuesize, args.lookups, args.cachesize,
+                         args.dictsize, args.threshold), indent=2))
+
+
+if __name__ == '__main__':
+    main()
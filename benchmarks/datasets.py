@@ -0,0 +1,84 @@
+'''Synthetic datasets for the benchmarks.
+'''
+import random
+import string
+
+
+DISTRIBUTIONS = ('sequential', 'uniform', 'zipf')
+
+
+def zipf(rng, count):
+    '''Returns key id in range(count) drawn from Zipf distribution with s=1, id 0 is the most frequent.
+    '''
+    # Approximation by the inverse of harmonic CDF
+    return min(int(count ** rng.random()) - 1, count - 1)
+
+
+def keys(count, distribution='sequential', seed=0):
+    '''Returns list of integer key ids in insertion order, every id of range(count) at least once.
+    The zipf order draws count ids from Zipf distribution, so the hot ids are written many
+    times, then the ids never drawn follow in random order.
+    '''
+    rng = random.Random(seed)
+
+    if distribution == 'sequential':
+        return list(range(count))
+
+    if distribution == 'uniform':
+        ids = list(range(count))
+        rng.shuffle(ids)
+        return ids
+
+    if distribution == 'zipf':
+        ids = [zipf(rng, count) for i in range(count)]
+        missing = sorted(set(range(count)).difference(ids))
+        rng.shuffle(missing)
+        return ids + missing
+
+    raise ValueError('Unknown distribution %r' % distribution)
+
+
+def picker(count, distribution='uniform', seed=0):
+    '''Returns function of no arguments which picks an existing key id for lookups.
+    '''
+    rng = random.Random(seed)
+
+    if distribution == 'sequential':
+        state = [0]
+
+        def pick():
+            state[0] = (state[0] + 1) % count
+            return state[0]
+
+        return pick
+
+    if distribution == 'uniform':
+        return lambda: rng.randrange(count)
+
+    if distribution == 'zipf':
+        return lambda: zipf(rng, count)
+
+    raise ValueError('Unknown distribution %r' % distribution)
+
+
+def value(size, n, rng=random):
+    '''Returns JSON-serializable record of roughly size bytes.
+    '''
+    return {
+        'id': n,
+        'color': rng.choice(('red', 'green', 'blue', 'black', 'white')),
+        'size': rng.randrange(10),
+        'name': ''.join(rng.choice(string.ascii_lowercase) for i in range(8)),
+        'pad': 'x' * max(size - 80, 0)
+    }
+
+
+def key(n):
+    return ['record', n]
+
+
+def populate(db, count, valuesize, distribution='sequential', seed=0):
+    rng = random.Random(seed)
+
+    for n in keys(count, distribution, seed):
+        db.put(key(n), value(valuesize, n, rng))
@@ -0,0 +1,80 @@
+'''Measures per-call overhead of the Db.get, Db.put and Db.exists fast path
+closures and of the natively bound delegated methods against the generic
+methods of the classes.
+
+    python benchmarks/fastpath.py --keys 10000 --calls 200000
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bdbo.db import *
+
+
+def timeit(function, args, calls):
+    started = time.perf_counter()
+
+    for i in range(calls):
+        function(*args)
+
+    return (time.perf_counter() - started) / calls * 1e9
+
+
+def run(count, calls, cachesize):
+    results = []
+
+    with tempfile.TemporaryDirectory() as home:
+        dbenv = DbEnv()
+        dbenv.set_cachesize(0, cachesize, 1)
+        dbenv.open(home, DB_CREATE | DB_INIT_MPOOL)
+
+        db = Db(dbenv)
+        db.open('bench.db', None, DB_BTREE, DB_CREATE)
+
+        for i in range(count):
+            db.put(['key', i], {'n': i})
+
+        key = ['key', count // 2]
+        data = {'n': 0}
+
+        # Class attributes are the generic methods, instance attributes the bound ones
+        for name, generic, fast, args in (
+                ('get', Db.get, db.get, (key,)),
+                ('get_missing', Db.get, db.get, (['missing'],)),
+                ('put', Db.put, db.put, (key, data)),
+                ('exists', Db.exists, db.exists, (key,)),
+                ('get_type', Db.get_type, db.get_type, ()),
+                ('env_get_cachesize', DbEnv.get_cachesize, dbenv.get_cachesize, ())):
+            owner = dbenv if name.startswith('env_') else db
+            generic_nsec = timeit(generic, (owner,) + args, calls)
+            fast_nsec = timeit(fast, args, calls)
+            results.append({
+                'method': name,
+                'generic_nsec': generic_nsec,
+                'fast_nsec': fast_nsec,
+                'speedup': generic_nsec / fast_nsec
+            })
+
+        db.close()
+        dbenv.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--keys', type=int, default=10000)
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--cachesize', type=int, default=16*1024*1024)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.keys, args.calls, args.cachesize), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''Measures read throughput of DbReplicaReader against the number of local
+replicas, and the replication lag right after a burst of master writes.
+
+    python benchmarks/replication.py --records 10000 --replicas 1 2 4
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bdbo.db import *
+from bdbo.replication import DbReplicaSet
+
+
+def run(records, replicas, reads, threads):
+    results = []
+
+    for count in replicas:
+        with tempfile.TemporaryDirectory() as home:
+            replicaset = DbReplicaSet(home, count)
+            db = Db(replicaset.master)
+            db.open('bench.db', None, DB_BTREE, DB_CREATE | DB_AUTO_COMMIT | DB_THREAD)
+
+            for i in range(records):
+                db.put(['key', i], {'n': i})
+
+            lag = max(r['lag_bytes'] for r in replicaset.lag())
+            started = time.time()
+            synced = replicaset.wait(60)
+            sync_seconds = time.time() - started
+
+            reader = replicaset.reader(db)
+
+            def worker(offset):
+                for i in range(offset, offset + reads // threads):
+                    reader.get(['key', i % records])
+
+            workers = [threading.Thread(target=worker, args=(t * reads // threads,)) for t in range(threads)]
+            started = time.time()
+
+            for w in workers:
+                w.start()
+
+            for w in workers:
+                w.join()
+
+            elapsed = time.time() - started
+            results.append({
+                'replicas': count,
+                'lag_bytes_after_writes': lag,
+                'synced': synced,
+                'sync_seconds': sync_seconds,
+                'reads_per_sec': reads / elapsed,
+                'reads': replicaset.stats()['reads']
+            })
+
+            db.close()
+            replicaset.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--replicas', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--reads', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.records, args.replicas, args.reads, args.threads), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+'''Benchmark runner of the bdbo hot paths.
+
+Runs scenarios of benchmarks/scenarios.py and prints the results as JSON:
+throughput, mean, p50 and p99 latency of every scenario.
+
+    python benchmarks/run.py --output baseline.json
+    python benchmarks/run.py --baseline baseline.json --tolerance 0.15
+
+With --baseline the results are compared against the stored ones, and the
+exit status is 1 if throughput or p99 latency of any scenario regressed by
+more than the tolerance.
+'''
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+
+from scenarios import SCENARIOS
+from datasets import DISTRIBUTIONS
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def measure(op, ops, threads, warmup):
+    for i in range(warmup):
+        op(i)
+
+    latencies = [[] for t in range(threads)]
+    per_thread = ops // threads
+
+    def worker(t):
+        timings = latencies[t]
+        clock = time.perf_counter
+        base = warmup + t * per_thread
+
+        for i in range(base, base + per_thread):
+            started = clock()
+            op(i)
+            timings.append(clock() - started)
+
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    started = time.perf_counter()
+
+    for w in workers:
+        w.start()
+
+    for w in workers:
+        w.join()
+
+    elapsed = time.perf_counter() - started
+    ordered = sorted(x for timings in latencies for x in timings)
+
+    return {
+        'ops': len(ordered),
+        'threads': threads,
+        'seconds': elapsed,
+        'throughput': len(ordered) / elapsed,
+        'mean_usec': sum(ordered) / (len(ordered) or 1) * 1e6,
+        'p50_usec': percentile(ordered, 0.50) * 1e6,
+        'p99_usec': percentile(ordered, 0.99) * 1e6
+    }
+
+
+def run(names, options):
+    results = {}
+
+    for name in names:
+        for threads in options['threads']:
+            with tempfile.TemporaryDirectory() as home:
+                op, close = SCENARIOS[name](home, options)
+
+                try:
+                    warmup = options['ops'] // 10 if options['cache'] == 'warm' else 0
+                    result = measure(op, options['ops'], threads, warmup)
+                finally:
+                    close()
+
+            results['%s/%s/t%i' % (name, options['cache'], threads)] = result
+            print('%-40s %12.0f ops/s  p50 %8.1f us  p99 %8.1f us' % (
+                name + ' t%i' % threads, result['throughput'],
+                result['p50_usec'], result['p99_usec']), file=sys.stderr)
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''Returns list of regressions of results against the baseline.
+    '''
+    regressions = []
+
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+
+        if not base:
+            continue
+
+        if result['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append('%s: throughput %.0f < %.0f' % (
+                name, result['throughput'], base['throughput']))
+
+        if result['p99_usec'] > base['p99_usec'] * (1 + tolerance):
+            regressions.append('%s: p99 %.1f us > %.1f us' % (
+                name, result['p99_usec'], base['p99_usec']))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', help='default: all of %s' % ', '.join(sorted(SCENARIOS)))
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--valuesize', type=int, default=200)
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform')
+    parser.add_argument('--cache', choices=('cold', 'warm'), default='warm')
+    parser.add_argument('--cachesize', type=int, default=64*1024*1024)
+    parser.add_argument('--ops', type=int, default=20000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write the results')
+    parser.add_argument('--baseline', help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    names = args.scenarios or sorted(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+
+    if unknown:
+        parser.error('unknown scenarios: %s' % ', '.join(sorted(unknown)))
+
+    options = {
+        'records': args.records,
+        'valuesize': args.valuesize,
+        'distribution': args.distribution,
+        'cache': args.cache,
+        'cachesize': args.cachesize,
+        'ops': args.ops,
+        'threads': args.threads,
+        'seed': args.seed
+    }
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'options': options
+        },
+        'results': run(names, options)
+    }
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+        regressions = compare(report['results'], baseline, args.tolerance)
+
+        for line in regressions:
+            print('REGRESSION', line, file=sys.stderr)
+
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+'''Benchmark scenarios of the bdbo hot paths.
+
+Every scenario is a function of (home, options) which prepares the
+databases in the empty directory home and returns (op, close), where
+op(i) performs one measured operation.
+'''
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bdbo.db import *
+from bdbo.util import lexpacker
+from bdbo.exjoin import DbExJoinMixin, eqjkeys
+from bdbo.tokens import DbTokens
+
+import datasets
+
+
+SCENARIOS = {}
+
+
+def scenario(f):
+    SCENARIOS[f.__name__] = f
+    return f
+
+
+ENV_FLAGS = DB_CREATE | DB_INIT_MPOOL | DB_INIT_LOCK | DB_INIT_LOG | DB_INIT_TXN | DB_THREAD
+
+
+def open_env(home, options):
+    dbenv = DbEnv()
+    dbenv.set_cachesize(0, options['cachesize'], 1)
+    dbenv.open(home, ENV_FLAGS)
+    return dbenv
+
+
+def open_db(dbenv, name, cls=Db, flags=0):
+    db = cls(dbenv)
+
+    if flags:
+        db.set_flags(flags)
+
+    db.open(name, None, DB_BTREE, DB_CREATE | DB_AUTO_COMMIT | DB_THREAD)
+    return db
+
+
+def populated(home, options):
+    '''Returns env and Db populated with the dataset.
+    For the cold cache the environment regions are removed and the environment
+    is reopened, so its cache is empty.
+    '''
+    dbenv = open_env(home, options)
+    db = open_db(dbenv, 'records.db')
+    datasets.populate(db, options['records'], options['valuesize'],
+                      options['distribution'], options['seed'])
+
+    if options['cache'] == 'cold':
+        db.close()
+        dbenv.close()
+        # Otherwise the cache pages survive in the region files of home
+        DbEnv().remove(home)
+        dbenv = open_env(home, options)
+        db = open_db(dbenv, 'records.db')
+
+    return dbenv, db
+
+
+def closer(*objects):
+    def close():
+        for obj in objects:
+            obj.close()
+
+    return close
+
+
+@scenario
+def lexpacker_dump(home, options):
+    dump, load = lexpacker()
+    key = ['user', 123456, b'\x00\x01', 'name']
+    return (lambda i: dump(key)), (lambda: None)
+
+
+@scenario
+def lexpacker_load(home, options):
+    dump, load = lexpacker()
+    rkey = dump(['user', 123456, b'\x00\x01', 'name'])
+    return (lambda i: load(rkey)), (lambda: None)
+
+
+@scenario
+def db_get(home, options):
+    dbenv, db = populated(home, options)
+    pick = datasets.picker(options['records'], options['distribution'], options['seed'])
+    return (lambda i: db.get(datasets.key(pick()))), closer(db, dbenv)
+
+
+@scenario
+def db_get_missing(home, options):
+    dbenv, db = populated(home, options)
+    records = options['records']
+    return (lambda i: db.get(datasets.key(records + i))), closer(db, dbenv)
+
+
+@scenario
+def db_put(home, options):
+    dbenv = open_env(home, options)
+    db = open_db(dbenv, 'records.db')
+    rng = random.Random(options['seed'])
+    record = datasets.value(options['valuesize'], 0, rng)
+    return (lambda i: db.put(datasets.key(i), record)), closer(db, dbenv)
+
+
+@scenario
+def write_batch(home, options):
+    dbenv = open_env(home, options)
+    db = open_db(dbenv, 'records.db')
+    rng = random.Random(options['seed'])
+    record = datasets.value(options['valuesize'], 0, rng)
+
+    def op(i):
+        with dbenv.write_batch() as batch:
+            for n in range(i * 100, i * 100 + 100):
+                batch.put(db, datasets.key(n), record)
+
+    return op, closer(db, dbenv)
+
+
+@scenario
+def group_commit_put(home, options):
+    dbenv = open_env(home, options)
+    dbenv.set_group_commit()
+    db = open_db(dbenv, 'records.db')
+    rng = random.Random(options['seed'])
+    record = datasets.value(options['valuesize'], 0, rng)
+
+    def op(i):
+        with dbenv.write_batch() as batch:
+            batch.put(db, datasets.key(i), record)
+
+    return op, closer(db, dbenv)
+
+
+@scenario
+def range_fetch(home, options):
+    dbenv, db = populated(home, options)
+    pick = datasets.picker(options['records'], options['distribution'], options['seed'])
+
+    def op(i):
+        begin = pick()
+
+        with db.rangecursor(datasets.key(begin), datasets.key(begin + 100)) as cursor:
+            for record in cursor.fetch(100):
+                pass
+
+    return op, closer(db, dbenv)
+
+
+@scenario
+def range_total(home, options):
+    dbenv = open_env(home, options)
+    db = Db(dbenv)
+    db.set_flags(DB_RECNUM)
+    db.open('records.db', None, DB_BTREE, DB_CREATE | DB_AUTO_COMMIT | DB_THREAD)
+    datasets.populate(db, options['records'], options['valuesize'],
+                      options['distribution'], options['seed'])
+    pick = datasets.picker(options['records'], options['distribution'], options['seed'])
+
+    def op(i):
+        begin = pick()
+
+        with db.rangecursor(datasets.key(begin), datasets.key(begin + 1000)) as cursor:
+            cursor.total()
+
+    return op, closer(db, dbenv)
+
+
+class JoinDb(DbExJoinMixin, Db):
+    pass
+
+
+@scenario
+def exjoin_fetch(home, options):
+    dbenv = open_env(home, options)
+    db = open_db(dbenv, 'records.db', JoinDb)
+    index = open_db(dbenv, 'index.db', flags=DB_DUPSORT)
+
+    @db.exjoin_associate(index, DB_CREATE)
+    def callback(key, data):
+        return eqjkeys([['color', data['color']], ['size', data['size']]], byname=data['name'])
+
+    datasets.populate(db, options['records'], options['valuesize'],
+                      options['distribution'], options['seed'])
+    rng = random.Random(options['seed'])
+
+    def op(i):
+        keys = [['color', rng.choice(('red', 'green'))], ['size', rng.randrange(10)]]
+
+        with db.exjoincursor(keys, 'byname') as cursor:
+            for record in cursor.fetch(20):
+                pass
+
+    return op, closer(index, db, dbenv)
+
+
+@scenario
+def tokens_create(home, options):
+    tokens = DbTokens(home, cachesize=options['cachesize'], maxgrouptokens=1000)
+    return (lambda i: tokens.create(i % 1000, {'n': i}, 3600)), tokens.close
+
+
+@scenario
+def tokens_authenticate(home, options):
+    tokens = DbTokens(home, cachesize=options['cachesize'], refreshtime=3600)
+    created = [tokens.create(n % 1000, {'n': n}, 3600)[0] for n in range(options['records'])]
+
+    if options['cache'] == 'cold':
+        tokens.close()
+        tokens = DbTokens(home, cachesize=options['cachesize'], refreshtime=3600)
+
+    pick = datasets.picker(len(created), options['distribution'], options['seed'])
+    return (lambda i: tokens.authenticate(created[pick()])), tokens.close
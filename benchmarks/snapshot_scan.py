@@ -0,0 +1,116 @@
+'''Measures Db.put latency of a writer during concurrent full range scans,
+with the scans in locking transactions and in snapshot transactions of the
+database opened with multiversion=True.
+
+    python benchmarks/snapshot_scan.py --keys 100000 --scanners 2 --seconds 10
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bdbo.db import *
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def scan(txn, db, count):
+    with db.rangecursor(['key', 0], ['key', count], txn) as cursor:
+        for record in cursor.fetch(count):
+            pass
+
+
+def scanner(dbenv, db, count, snapshot, stop, result):
+    # Deadlocked scans are retried by DbEnv.txn_run and counted in its stats
+    flags = DB_TXN_SNAPSHOT if snapshot else 0
+
+    while not stop.is_set():
+        dbenv.txn_run(scan, db, count, flags=flags, name='scan')
+        result['scans'] += 1
+
+
+def writer(dbenv, db, count, stop, latencies):
+    i = 0
+
+    while not stop.is_set():
+        key = ['key', i % count]
+        started = time.perf_counter()
+        dbenv.txn_run(lambda txn: db.put(key, {'n': i}, txn), name='writer')
+        latencies.append(time.perf_counter() - started)
+        i += 7919
+
+
+def run(count, scanners, seconds, cachesize):
+    results = []
+
+    for snapshot in (False, True):
+        with tempfile.TemporaryDirectory() as home:
+            dbenv = DbEnv()
+            dbenv.set_cachesize(0, cachesize, 1)
+            dbenv.open(home, DB_CREATE | DB_INIT_MPOOL | DB_INIT_LOCK |
+                             DB_INIT_LOG | DB_INIT_TXN | DB_THREAD)
+
+            db = Db(dbenv)
+            db.open('bench.db', None, DB_BTREE, DB_CREATE | DB_AUTO_COMMIT | DB_THREAD,
+                    multiversion=snapshot)
+
+            for i in range(count):
+                db.put(['key', i], {'n': i})
+
+            stop = threading.Event()
+            latencies = []
+            result = {'snapshot': snapshot, 'scans': 0}
+            threads = [threading.Thread(target=scanner, args=(dbenv, db, count, snapshot, stop, result))
+                       for n in range(scanners)]
+            threads.append(threading.Thread(target=writer, args=(dbenv, db, count, stop, latencies)))
+
+            for t in threads:
+                t.start()
+
+            time.sleep(seconds)
+            stop.set()
+
+            for t in threads:
+                t.join()
+
+            ordered = sorted(latencies)
+            stats = dbenv.txn_runstats()
+            result.update({
+                'puts': len(ordered),
+                'put_p50_usec': percentile(ordered, 0.50) * 1e6,
+                'put_p99_usec': percentile(ordered, 0.99) * 1e6,
+                'put_max_usec': (ordered[-1] if ordered else 0.0) * 1e6,
+                'put_retries': stats.get('writer', {}).get('retries', 0),
+                'scan_retries': stats.get('scan', {}).get('retries', 0)
+            })
+            results.append(result)
+
+            db.close()
+            dbenv.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--keys', type=int, default=100000)
+    parser.add_argument('--scanners', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--cachesize', type=int, default=64*1024*1024)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.keys, args.scanners, args.seconds, args.cachesize), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''Measures random get throughput of a read-only Db against the same range
+exported to an SSTable, and the export rate.
+
+    python benchmarks/sstable.py --records 100000 --reads 200000
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bdbo.db import *
+from bdbo.sstable import export, SSTable
+
+
+def run(records, reads, cachesize, blockrecords):
+    with tempfile.TemporaryDirectory() as home:
+        dbenv = DbEnv()
+        dbenv.set_cachesize(0, cachesize, 1)
+        dbenv.open(home, DB_CREATE | DB_INIT_MPOOL | DB_THREAD)
+        db = Db(dbenv)
+        db.open('bench.db', None, DB_BTREE, DB_CREATE | DB_THREAD)
+
+        for i in range(records):
+            db.put(['key', i], {'n': i})
+
+        path = os.path.join(home, 'bench.sst')
+        started = time.time()
+        export(db, path, ['key'], blockrecords=blockrecords)
+        export_seconds = time.time() - started
+
+        keys = [['key', random.randrange(records)] for i in range(reads)]
+        table = SSTable(path, db)
+        results = {'records': records, 'export_per_sec': records / export_seconds}
+
+        for name, source in (('db', db), ('sstable', table)):
+            started = time.time()
+
+            for key in keys:
+                source.get(key)
+
+            results[name + '_gets_per_sec'] = reads / (time.time() - started)
+
+        table.close()
+        db.close()
+        dbenv.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--reads', type=int, default=200000)
+    parser.add_argument('--cachesize', type=int, default=32*1024*1024)
+    parser.add_argument('--blockrecords', type=int, default=64)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.records, args.reads, args.cachesize, args.blockrecords), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+'''Compares DbTokens page usage and cache efficiency of the legacy
+and the compact record formats.
+
+    python benchmarks/tokens_format.py --tokens 100000
+'''
+import os
+import sys
+import json
+import time
+import random
+import struct
+import marshal
+import argparse
+import tempfile
+
+from binascii import hexlify
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bdbo.tokens import DbTokens
+
+
+legacypack = struct.Struct('255p d d').pack
+
+
+def populate(tokens, count, legacy):
+    created = []
+
+    for i in range(count):
+        group, data, ttl = i % 1000, {'n': i}, 3600
+
+        if legacy:
+            # Written as the previous versions of DbTokens did
+            key = next(tokens._keypool)
+            value = legacypack(key, time.time(), ttl) + marshal.dumps((group, data))
+            tid = tokens.db_tokens.append(value)
+            created.append(hexlify(tokens._tokenpack(tid, key)).decode())
+        else:
+            created.append(tokens.create(group, data, ttl)[0])
+
+    return created
+
+
+def measure(tokens, created, lookups):
+    stat = tokens.db_tokens.stat()
+    before = tokens.dbenv.memp_stat()[0]
+    sample = random.sample(created, min(lookups, len(created)))
+    started = time.time()
+
+    for token in sample:
+        tokens.authenticate(token)
+
+    elapsed = time.time() - started
+    after = tokens.dbenv.memp_stat()[0]
+    hits = after['cache_hit'] - before['cache_hit']
+    misses = after['cache_miss'] - before['cache_miss']
+
+    return {
+        'leaf_pages': stat['leaf_pg'],
+        'overflow_pages': stat['over_pg'],
+        'cache_hit_rate': hits / ((hits + misses) or 1),
+        'authenticate_per_sec': len(sample) / elapsed
+    }
+
+
+def run(count, lookups, cachesize):
+    result = {}
+
+    for name, legacy in (('legacy', True), ('compact', False)):
+        with tempfile.TemporaryDirectory() as dbdir:
+            tokens = DbTokens(dbdir, cachesize=cachesize, refreshtime=3600)
+
+            try:
+                created = populate(tokens, count, legacy)
+                result[name] = measure(tokens, created, lookups)
+
+                if legacy:
+                    tokens.migrate()
+                    result['migrated'] = measure(tokens, created, lookups)
+            finally:
+                tokens.close()
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tokens', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=50000)
+    parser.add_argument('--cachesize', type=int, default=1024*1024)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.tokens, args.lookups, args.cachesize), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''Measures DbTokens.create throughput with concurrent threads sharing
+one instance, and the raw rate of its key source.
+
+    python benchmarks/tokens_keygen.py --threads 1 2 4 8 16
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bdbo.tokens import DbTokens, KeySource
+
+
+def keys_per_sec(threads, count):
+    source = KeySource(24)
+
+    def worker():
+        for i in range(count):
+            next(source)
+
+    return threads * count / timed(worker, threads)
+
+
+def creates_per_sec(threads, count):
+    with tempfile.TemporaryDirectory() as dbdir:
+        tokens = DbTokens(dbdir, maxgrouptokens=count * threads)
+
+        def worker():
+            group = threading.get_ident()
+
+            for i in range(count):
+                tokens.create(group, None, 3600)
+
+        try:
+            return threads * count / timed(worker, threads)
+        finally:
+            tokens.close()
+
+
+def timed(worker, threads):
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    started = time.time()
+
+    for w in workers:
+        w.start()
+
+    for w in workers:
+        w.join()
+
+    return time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--tokens', type=int, default=5000, help='tokens per thread')
+    args = parser.parse_args()
+
+    print(json.dumps([{
+        'threads': n,
+        'keys_per_sec': keys_per_sec(n, args.tokens * 20),
+        'creates_per_sec': creates_per_sec(n, args.tokens)
+    } for n in args.threads], indent=2))
+
+
+if __name__ == '__main__':
+    main()
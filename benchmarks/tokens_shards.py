@@ -0,0 +1,74 @@
+'''Measures DbShardedTokens creation throughput against the number of shards
+with several creator processes.
+
+    python benchmarks/tokens_shards.py --processes 8 --shards 1 2 4 8
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bdbo.tokens import DbShardedTokens
+
+
+def creator(dbdir, shards, count, offset, start):
+    tokens = DbShardedTokens(dbdir, shards)
+
+    try:
+        start.wait()
+
+        for i in range(offset, offset + count):
+            tokens.create(i, None, 3600)
+    finally:
+        tokens.close()
+
+
+def run(shards, processes, count):
+    with tempfile.TemporaryDirectory() as dbdir:
+        # Environments are created once, before the workers join
+        DbShardedTokens(dbdir, shards).close()
+
+        start = multiprocessing.Event()
+        workers = [multiprocessing.Process(target=creator,
+                                           args=(dbdir, shards, count, i * count, start))
+                   for i in range(processes)]
+
+        for w in workers:
+            w.start()
+
+        # Let the workers open their environments
+        time.sleep(1)
+        started = time.time()
+        start.set()
+
+        for w in workers:
+            w.join()
+
+        elapsed = time.time() - started
+
+    return {
+        'shards': shards,
+        'processes': processes,
+        'tokens': processes * count,
+        'seconds': elapsed,
+        'tokens_per_sec': processes * count / elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--tokens', type=int, default=20000, help='tokens per process')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    print(json.dumps([run(n, args.processes, args.tokens) for n in args.shards], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+'''Measures DbWorkQueue throughput, jobs processed per second, against the
+number of consumer processes, and the enqueue rate of batches.
+
+    python benchmarks/workqueue.py --jobs 100000 --consumers 1 2 4 8
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bdbo.db import *
+from bdbo.workqueue import DbWorkQueue, WORKER_ENV_FLAGS, start_workers
+
+
+def noop(data):
+    pass
+
+
+def run(jobs, consumers, batch, cachesize):
+    results = []
+
+    for count in consumers:
+        with tempfile.TemporaryDirectory() as home:
+            dbenv = DbEnv()
+            dbenv.set_cachesize(0, cachesize, 1)
+            dbenv.open(home, WORKER_ENV_FLAGS)
+            queue = DbWorkQueue(dbenv, 'bench')
+
+            started = time.time()
+
+            for i in range(0, jobs, batch):
+                queue.enqueue([{'job': n} for n in range(i, min(i + batch, jobs))])
+
+            enqueue_seconds = time.time() - started
+
+            started = time.time()
+            workers, stop = start_workers(home, 'bench', noop, count, batch)
+
+            while queue.depth() or queue.stats()['inflight']:
+                time.sleep(0.01)
+
+            elapsed = time.time() - started
+            stop.set()
+
+            for w in workers:
+                w.join()
+
+            results.append({
+                'consumers': count,
+                'jobs': jobs,
+                'enqueue_per_sec': jobs / enqueue_seconds,
+                'jobs_per_sec': jobs / elapsed
+            })
+
+            queue.close()
+            dbenv.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=100000)
+    parser.add_argument('--consumers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--cachesize', type=int, default=32*1024*1024)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.jobs, args.consumers, args.batch, args.cachesize), indent=2))
+
+
+if __name__ == '__main__':
+    main()